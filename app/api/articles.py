@@ -1,13 +1,79 @@
-from fastapi import APIRouter, HTTPException
+import os
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import TypeAdapter, ValidationError
+from schemas.articles import ArticleContent, ArticleIn, ArticlePage, BulkArticlesResponse, ExpiryResponse
 from services.articles import articles_service, Article
+from services.pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from services.chroma import chroma_service
+from services.local_index import local_index_service
 
 router = APIRouter()
 
+# Articles written to Mongo per bulk write while ingesting
+ARTICLE_INGEST_BATCH_SIZE = int(os.getenv("ARTICLE_INGEST_BATCH_SIZE", "500"))
+
+article_list_adapter = TypeAdapter(list[ArticleIn])
+
 @router.post("/articles", response_model=dict)
-async def create_article(title: str, url: str):
-    article_id = await articles_service.store_article(title, url)
+async def create_article(title: str, url: str, body: Optional[ArticleContent] = None):
+    article_id = await articles_service.store_article(title, url, body.content if body else None)
     return {"id": article_id}
 
+async def read_ndjson_articles(request: Request):
+    """Parse an NDJSON request body line by line as it streams in"""
+    buffer = b""
+    line_number = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+    if buffer.strip():
+        yield line_number + 1, buffer
+
+@router.post("/articles/bulk", response_model=BulkArticlesResponse)
+async def create_articles(request: Request):
+    """Upsert many articles by url. Accepts a JSON array or NDJSON (one article per
+    line, Content-Type application/x-ndjson) and returns ids in input order, with the
+    urls of any articles whose id could not be resolved in `missing`"""
+    ids = []
+    missing = []
+    batch = []
+
+    async def flush():
+        stored = await articles_service.store_articles(batch)
+        ids.extend(stored)
+        missing.extend(url for (_, url, _), article_id in zip(batch, stored) if article_id is None)
+        batch.clear()
+
+    if "ndjson" in request.headers.get("content-type", ""):
+        async for line_number, line in read_ndjson_articles(request):
+            try:
+                article = ArticleIn.model_validate_json(line)
+            except ValidationError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid article on line {line_number}: {e}")
+            batch.append((article.title, article.url, article.content))
+            if len(batch) >= ARTICLE_INGEST_BATCH_SIZE:
+                await flush()
+    else:
+        try:
+            articles = article_list_adapter.validate_json(await request.body())
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid articles: {e}")
+        for article in articles:
+            batch.append((article.title, article.url, article.content))
+            if len(batch) >= ARTICLE_INGEST_BATCH_SIZE:
+                await flush()
+
+    if batch:
+        await flush()
+    return BulkArticlesResponse(ids=ids, missing=missing)
+
 @router.get("/articles/{article_id}", response_model=Article)
 async def get_article(article_id: str):
     article = await articles_service.get_article(article_id)
@@ -22,12 +88,42 @@ async def delete_article(article_id: str):
         raise HTTPException(status_code=404, detail="Article not found")
     return {"message": "Article deleted successfully"}
 
-@router.get("/articles/older-than/{timestamp}", response_model=list[Article])
-async def get_articles_older_than(timestamp: str, limit: int = 10, offset: int = 0):
-    from datetime import datetime
+def parse_timestamp(timestamp: str) -> datetime:
     try:
-        dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-        articles = await articles_service.get_articles_older_than(dt, limit, offset)
-        return articles
+        return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
     except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid timestamp format") 
\ No newline at end of file
+        raise HTTPException(status_code=400, detail="Invalid timestamp format")
+
+@router.get("/articles/older-than/{timestamp}", response_model=ArticlePage)
+async def get_articles_older_than(timestamp: str, limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+                                  cursor: Optional[str] = None):
+    """Page through articles older than `timestamp`, oldest first. Pass the returned
+    `next_cursor` to fetch the next page; it is null on the last page"""
+    dt = parse_timestamp(timestamp)
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    articles = await articles_service.get_articles_older_than(dt, limit, after)
+    next_cursor = None
+    if len(articles) == limit:
+        next_cursor = encode_cursor(articles[-1].timestamp, articles[-1].id)
+    return ArticlePage(articles=articles, next_cursor=next_cursor)
+
+@router.delete("/articles/older-than/{timestamp}", response_model=ExpiryResponse)
+async def expire_articles_older_than(timestamp: str):
+    """Delete every article older than `timestamp` and drop its chunks from the vector index"""
+    dt = parse_timestamp(timestamp)
+    expired = await articles_service.expire_articles(dt)
+
+    if articles_service.retention_seconds is not None:
+        # Articles removed by the TTL index leave their chunks behind - sweep those too
+        indexed = await chroma_service.asources()
+        expired += list(indexed - set(expired) - await articles_service.existing_ids(indexed))
+
+    await chroma_service.adelete_sources(expired)
+    # Also moves every worker's semantic cache to a new index version, as cached answers
+    # may reference deleted articles
+    await local_index_service.adelete_sources(expired)
+    return ExpiryResponse(deleted=len(expired), ids=expired) 
\ No newline at end of file
@@ -1,16 +1,40 @@
-from fastapi import APIRouter
+import asyncio
+import json
+import os
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from schemas.chat import ChatRequest, ChatResponse, Reference
-from services.chatbot import generate_response
+from services.chatbot import cache_response, generate_response, stream_response
 from services.mongodb import mongodb
 from services.articles import articles_service
-from typing import List, Any
-from langchain_openai import ChatOpenAI
+from services.pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from typing import Dict, List, Any, Optional
 from prompts.relevance_check_prompt import relevance_check_prompt
+from services.llm import LLMUnavailable, utility_llm
+from services.metrics import timed, trace_request
+from services.single_flight import reference_flights
 
 router = APIRouter()
 
-# LLM for relevance checking
-relevance_llm = ChatOpenAI(temperature=0.1)
+# Maximum number of documentation references returned per answer
+MAX_REFERENCES = 2
+
+# Relevance mode: "llm" grades every candidate with the LLM, "score" trusts the vector 
+# distance and only asks the LLM about candidates in the ambiguous band between thresholds
+RELEVANCE_MODE = os.getenv("RELEVANCE_MODE", "llm").lower()
+# Squared L2 distances on normalized OpenAI embeddings (0 = identical, 4 = opposite)
+RELEVANCE_ACCEPT_DISTANCE = float(os.getenv("RELEVANCE_ACCEPT_DISTANCE", "0.3"))
+RELEVANCE_REJECT_DISTANCE = float(os.getenv("RELEVANCE_REJECT_DISTANCE", "0.5"))
+
+# Seconds clients are asked to wait after the LLM gateway shed their request
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "5"))
+
+# LLM for relevance checking - shares the long-lived client and connection pool
+relevance_llm = utility_llm
 
 async def is_relevant_source(question: str, doc_content: str) -> bool:
     """Check if a source document is relevant to the user's question"""
@@ -21,85 +45,187 @@ async def is_relevant_source(question: str, doc_content: str) -> bool:
             document_content=doc_content[:500] + "..."
         )
 
-        response = relevance_llm.invoke(relevance_prompt_str).content.strip().upper()
+        with timed("relevance_check"):
+            response = (await relevance_llm.ainvoke(relevance_prompt_str)).content.strip().upper()
         return response == "YES"
 
+    except LLMUnavailable:
+        raise
     except Exception as e:
         print(f"Relevance check error: {e}")
         # Default to including the reference if check fails
         return True
 
-async def format_references(source_docs: List[Any], question: str) -> List[Reference]:
-    """Format source documents into readable references - only relevant documentation sources"""
-    references = []
-    seen_sources = set()
-    
-    for doc in source_docs:
-        # Only return top 2 references
-        if len(references) >= 2:
-            break
-
-        metadata = doc.metadata
-        source_type = metadata.get("source", "unknown")
-        
-        # Skip chat history sources. We only want to show documentation sources
-        if source_type == "chat_history":
-            continue
+async def check_relevance(question: str, doc: Any) -> bool:
+    """Decide relevance from the vector distance when possible, falling back to the LLM grader"""
+    score = doc.metadata.get("score")
+    if RELEVANCE_MODE == "score" and score is not None:
+        if score <= RELEVANCE_ACCEPT_DISTANCE:
+            return True
+        if score >= RELEVANCE_REJECT_DISTANCE:
+            return False
 
+    try:
+        return await is_relevant_source(question, doc.page_content)
+    except LLMUnavailable:
+        # Under overload grade on distance alone, keeping anything not clearly off-topic
+        return score is None or score < RELEVANCE_REJECT_DISTANCE
+
+async def select_relevant_sources(source_docs: List[Any], question: str) -> List[str]:
+    """Pick the top relevant documentation sources. Candidates are graded concurrently 
+    in waves of as many as there are references still to fill, so a chat makes no more 
+    LLM calls than needed"""
+    # Skip chat history sources. We only want to show documentation sources, each once - 
+    # the first chunk of a source is its best-ranked one
+    candidates = {}
+    for doc in source_docs:
         # For Chroma/vector DB documents - source is always a UUID
-        source_uuid = metadata.get("source", "Documentation")
+        source_uuid = doc.metadata.get("source", "Documentation")
+        if source_uuid != "chat_history":
+            candidates.setdefault(source_uuid, doc)
+    candidates = list(candidates.items())
+
+    relevant_sources = []
+    while candidates and len(relevant_sources) < MAX_REFERENCES:
+        wave = candidates[:MAX_REFERENCES - len(relevant_sources)]
+        candidates = candidates[len(wave):]
+        checks = await asyncio.gather(*(check_relevance(question, doc) for _, doc in wave))
+        # Keep retrieval order so the best-ranked sources win
+        relevant_sources.extend(source_uuid for (source_uuid, _), relevant in zip(wave, checks)
+                                if relevant)
+
+    return relevant_sources
 
-        # Only add if not already seen (UUID already found to be relevant)
-        if source_uuid in seen_sources:
-            continue
+async def format_references(source_docs: List[Any], question: str) -> List[Reference]:
+    """Format source documents into readable references - only relevant documentation sources"""
+    relevant_sources = await select_relevant_sources(source_docs, question)
+    if not relevant_sources:
+        return []
 
-        # Check if this source is relevant to the question
-        if not await is_relevant_source(question, doc.page_content):
-            continue
+    # Resolve titles and URLs for all references in one (usually cached) lookup
+    try:
+        articles = await articles_service.get_articles(relevant_sources)
+    except Exception as e:
+        print(f"Error fetching articles' titles and urls {relevant_sources}: {e}")
+        return []
 
-        # UUID is relevant - add to references and mark as seen
-        seen_sources.add(source_uuid)
+    references = []
+    for source_uuid in relevant_sources:
+        # Fallback if article not found
+        title, url = articles.get(source_uuid, ("Documentation", source_uuid))
+        references.append(Reference(title=title, url=url))
 
-        # Query articles service to get title and URL
-        try:
-            article = await articles_service.get_article(source_uuid)
-            if article:
-                references.append(Reference(
-                    title=article.title,
-                    url=article.url
-                ))
-            else:
-                # Fallback if article not found
-                references.append(Reference(
-                    title="Documentation",
-                    url=source_uuid
-                ))
+    return references
 
-        except Exception as e:
-            print(f"Error fetching article's title and url {source_uuid}: {e}")
+async def format_and_cache_references(response: Dict[str, Any], question: str) -> List[Reference]:
+    """Format references with relevance checking and cache the answer with them"""
+    references = await format_references(response["source_docs"], question)
+    cache_response(response, references)
+    return references
 
+async def resolve_references(response: Dict[str, Any], question: str) -> List[Reference]:
+    """References for a generated response - semantic cache hits already carry theirs"""
+    references = response["references"]
+    if references is None:
+        # Identical answers in flight share one round of relevance grading
+        key = (question, tuple((doc.metadata.get("source"), doc.page_content)
+                               for doc in response["source_docs"]))
+        references = await reference_flights.run(
+            key, lambda: format_and_cache_references(response, question)
+        )
     return references
 
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def service_unavailable(error: LLMUnavailable) -> HTTPException:
+    """Fast 503 for answers the LLM gateway shed or timed out"""
+    print(f"Answer unavailable: {error}")
+    return HTTPException(
+        status_code=503,
+        detail="The assistant is busy right now, please try again shortly",
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
-    response = await generate_response(request.question, request.session_id)
-    answer = response["answer"]
-    source_docs = response["source_docs"]
-
-    # Format references with relevance checking
-    references = await format_references(source_docs, request.question)
+    with trace_request("chat", session_id=request.session_id):
+        try:
+            response = await generate_response(request.question, request.session_id)
+        except LLMUnavailable as e:
+            raise service_unavailable(e)
+        answer = response["answer"]
+        references = await resolve_references(response, request.question)
 
-    # Store chat in MongoDB with session ID
-    await mongodb.store_chat(request.question, answer, request.session_id)
+        # Store chat in MongoDB with session ID
+        await mongodb.store_chat(request.question, answer, request.session_id)
 
     return ChatResponse(
         answer=answer,
         references=references
     )
 
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Stream the answer as server-sent events: "token" events while the answer is 
+    generated, then "references" and "done". History is written after the stream closes"""
+    completed = {}
+
+    async def event_stream():
+        try:
+            with trace_request("chat_stream", session_id=request.session_id):
+                async for kind, payload in stream_response(request.question, request.session_id):
+                    if kind == "token":
+                        yield sse_event("token", {"token": payload})
+                    else:
+                        response = payload
+
+                references = await resolve_references(response, request.question)
+                yield sse_event("references", {
+                    "references": [reference.model_dump() for reference in references]
+                })
+                completed["answer"] = response["answer"]
+                yield sse_event("done", {})
+
+        except LLMUnavailable as e:
+            print(f"Answer unavailable: {e}")
+            yield sse_event("error", {
+                "detail": "The assistant is busy right now, please try again shortly",
+                "retry_after": RETRY_AFTER_SECONDS
+            })
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            yield sse_event("error", {"detail": "Failed to generate a response"})
+
+    async def store_streamed_chat():
+        # Only completed answers become part of the conversation history
+        if "answer" in completed:
+            await mongodb.store_chat(request.question, completed["answer"], request.session_id)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        background=BackgroundTask(store_streamed_chat)
+    )
+
 @router.get("/chat/history")
-async def get_chat_history(session_id: str, limit: int = 10):
-    history = await mongodb.get_chat_history(session_id, limit)
+async def get_chat_history(session_id: str, limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+                           cursor: Optional[str] = None):
+    """Page through a session's history, newest first. Pass the returned `next_cursor`
+    to fetch older chats; it is null on the last page"""
+    try:
+        before = None
+        if cursor:
+            timestamp, chat_id = decode_cursor(cursor)
+            before = (timestamp, ObjectId(chat_id))
+    except (ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    history = await mongodb.get_chat_history(session_id, limit, before)
+    next_cursor = None
+    if len(history) == limit:
+        next_cursor = encode_cursor(history[-1]["timestamp"], str(history[-1]["_id"]))
     return {
         "history": [
             {
@@ -109,7 +235,8 @@ async def get_chat_history(session_id: str, limit: int = 10):
                 "timestamp": doc["timestamp"]
             } 
             for doc in history
-        ]
+        ],
+        "next_cursor": next_cursor
     }
 
 @router.delete("/chat/session/{session_id}")
@@ -1,6 +1,9 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from api.chat import router as chat_router
 from api.articles import router as articles_router
+from services.semantic_cache import semantic_cache
+from services.single_flight import reference_flights, response_flights
 
 router = APIRouter()
 
@@ -8,6 +11,21 @@ router = APIRouter()
 async def health():
     return {"status": "healthy"}
 
+@router.get("/cache/stats")
+async def cache_stats():
+    return {
+        "semantic_cache": semantic_cache.stats(),
+        "single_flight": {
+            "responses": response_flights.stats(),
+            "references": reference_flights.stats()
+        }
+    }
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus metrics: request and per-stage latency, LLM tokens, cache hits"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # Include chat routes
 router.include_router(chat_router)
 
@@ -1,8 +1,26 @@
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from api.routes import router
+from services.articles import articles_service
+from services.metrics import REQUEST_LATENCY
+from services.mongodb import mongodb
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Make sure every hot query is index-backed before serving traffic
+    for service in (mongodb, articles_service):
+        try:
+            await service.ensure_indexes()
+            for query in await service.check_query_plans():
+                print(f"Warning: {query} query is not using an index")
+        except Exception as e:
+            print(f"Index bootstrap error: {e}")
+    yield
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -12,4 +30,19 @@ app.add_middleware(
     allow_headers=["*"],  
 )
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template so path parameters don't explode the label set
+        route = request.scope.get("route")
+        REQUEST_LATENCY.labels(
+            request.method, route.path if route else "unmatched", str(status)
+        ).observe(time.perf_counter() - start)
+
 app.include_router(router)
\ No newline at end of file
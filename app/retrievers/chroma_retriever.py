@@ -3,66 +3,118 @@ from typing import List, Any
 
 from langchain.schema import Document
 from langchain_core.retrievers import BaseRetriever
-from langchain_openai import ChatOpenAI
 
-from services.mongodb import mongodb
 from services.chroma import chroma_service
+from services.llm import LLMUnavailable, utility_llm
+from services.metrics import timed
+from services.session_context import current_session
 from prompts.query_enhancement_prompt import query_enhancement_prompt
 
 class ChromaRetriever(BaseRetriever):
     """Context-aware Chroma retriever that enhances queries with conversation 
-    history from a specific session"""
+    history from the current session"""
     
-    mongodb_instance: Any
     llm: Any
     k: int
-    session_id: str
     
     @classmethod
-    def create(cls, mongodb_instance, session_id: str, k: int = 4):
+    def create(cls, llm, k: int = 4):
         """Factory method to create ContextAwareChromaRetriever"""
         return cls(
-            mongodb_instance=mongodb_instance,
-            session_id=session_id,
-            llm=ChatOpenAI(temperature=0.1),
+            llm=llm,
             k=k
         )
     
+    def _build_enhancement_prompt(self, query: str, recent_chats: List[dict]) -> str:
+        """Build the query enhancement prompt from recent chat history"""
+        # Build conversation context
+        conversation_context = []
+        for chat in reversed(recent_chats):  # Reverse for chronological order
+            conversation_context.append(f"User: {chat['question']}")
+            conversation_context.append(f"Assistant: {chat['answer']}")
+        
+        context_str = "\n".join(conversation_context)
+        
+        # Use the prompt template from prompts folder
+        return query_enhancement_prompt.format(
+            conversation_history=context_str,
+            current_question=query
+        )
+    
     def _enhance_query_with_context(self, query: str) -> str:
         """Enhance the query with conversation context"""
         try:
             # Get recent chat history for this session
-            recent_chats = self.mongodb_instance.get_chat_history_sync(self.session_id, 3)
+            recent_chats = current_session.get().get_history_sync(3)
             
             if not recent_chats:
                 return query
             
-            # Build conversation context
-            conversation_context = []
-            for chat in reversed(recent_chats):  # Reverse for chronological order
-                conversation_context.append(f"User: {chat['question']}")
-                conversation_context.append(f"Assistant: {chat['answer']}")
+            enhancement_prompt_str = self._build_enhancement_prompt(query, recent_chats)
+            enhanced_query = self.llm.invoke(enhancement_prompt_str).content.strip()
+
+            # Fallback to original query if enhancement fails
+            if not enhanced_query:
+                return query
+
+            return enhanced_query 
             
-            context_str = "\n".join(conversation_context)
+        except Exception as e:
+            print(f"Query enhancement error: {e}")
+            return query
+    
+    async def aenhance_query(self, query: str) -> str:
+        """Enhanced query for the current request - computed once and shared by every stage"""
+        return await current_session.get().shared(
+            ("enhanced_query", query), lambda: self._aenhance_query_with_context(query)
+        )
+    
+    async def aembed_query(self, query: str) -> List[float]:
+        """Embedding of the enhanced query for the current request - computed once and shared"""
+        enhanced_query = await self.aenhance_query(query)
+        return await current_session.get().shared(
+            ("embedding", enhanced_query), lambda: chroma_service.aembed_query(enhanced_query)
+        )
+    
+    async def _aenhance_query_with_context(self, query: str) -> str:
+        """Async version of query enhancement - reads history via motor and calls the LLM 
+        without blocking the event loop"""
+        try:
+            recent_chats = await current_session.get().get_history(3)
             
-            # Use the prompt template from prompts folder
-            enhancement_prompt_str = query_enhancement_prompt.format(
-                conversation_history=context_str,
-                current_question=query
-            )
+            if not recent_chats:
+                return query
             
-            enhanced_query = self.llm.invoke(enhancement_prompt_str).content.strip()
+            enhancement_prompt_str = self._build_enhancement_prompt(query, recent_chats)
+            with timed("query_enhancement"):
+                enhanced_query = (await self.llm.ainvoke(enhancement_prompt_str)).content.strip()
 
             # Fallback to original query if enhancement fails
             if not enhanced_query:
                 return query
 
-            return enhanced_query 
+            return enhanced_query
             
+        except LLMUnavailable as e:
+            # Under overload search with the raw question rather than fail the request
+            print(f"Query enhancement skipped: {e}")
+            return query
         except Exception as e:
             print(f"Query enhancement error: {e}")
             return query
     
+    def _annotate(self, results: List[tuple], query: str, enhanced_query: str) -> List[Document]:
+        """Attach query enhancement info and vector distance to document metadata"""
+        docs = []
+        for doc, score in results:
+            doc.metadata["original_query"] = query
+            doc.metadata["enhanced_query"] = enhanced_query
+            # Distance from the enhanced query - used for score-based relevance filtering
+            doc.metadata["score"] = score
+            docs.append(doc)
+        
+        return docs
+    
     def _get_relevant_documents(self, query: str) -> List[Document]:
         """Get relevant documents using enhanced query"""
         try:
@@ -70,23 +122,28 @@ class ChromaRetriever(BaseRetriever):
             enhanced_query = self._enhance_query_with_context(query)
             
             # Use chroma service for similarity search (with built-in retry logic)
-            docs = chroma_service.similarity_search(enhanced_query, k=self.k)
+            results = chroma_service.similarity_search_with_score(enhanced_query, k=self.k)
             
-            # Add query enhancement info to metadata
-            for doc in docs:
-                doc.metadata["original_query"] = query
-                doc.metadata["enhanced_query"] = enhanced_query
-            
-            return docs
+            return self._annotate(results, query, enhanced_query)
             
         except Exception as e:
             print(f"Context-aware Chroma retriever error: {e}")
             return []  # Return empty list if everything fails
 
     async def _aget_relevant_documents(self, query: str) -> List[Document]:
-        """Async version - delegates to sync version"""
-        return self._get_relevant_documents(query)
+        """Async version - enhancement, embedding and search never block the event loop"""
+        try:
+            enhanced_query = await self.aenhance_query(query)
+            embedding = await self.aembed_query(query)
+            
+            results = await chroma_service.asimilarity_search_by_vector_with_score(embedding, k=self.k)
+            
+            return self._annotate(results, query, enhanced_query)
+            
+        except Exception as e:
+            print(f"Context-aware Chroma retriever error: {e}")
+            return []
 
-def create_chroma_retriever(session_id: str):
+def create_chroma_retriever():
     """Factory function to create session-aware ChromaDB retriever"""
-    return ChromaRetriever.create(mongodb, session_id)
\ No newline at end of file
+    return ChromaRetriever.create(utility_llm)
\ No newline at end of file
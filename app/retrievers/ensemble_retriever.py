@@ -1,17 +1,21 @@
 from langchain.retrievers.ensemble import EnsembleRetriever
 
 from retrievers.chroma_retriever import create_chroma_retriever
+from retrievers.lexical_retriever import LexicalRetriever
 from retrievers.mongodb_retriever import MongoDBRetriever
-from services.mongodb import mongodb
 
-def create_ensemble_retriever(session_id: str):
-    """Create ensemble retriever with session-aware retrievers"""
+def create_ensemble_retriever(chroma_retriever=None):
+    """Create ensemble retriever with session-aware retrievers. The session is read from 
+    the session context at query time, so one retriever serves every session"""
     # Create session-aware retrievers
-    chroma_retriever = create_chroma_retriever(session_id)
-    mongodb_retriever = MongoDBRetriever.create(mongodb, session_id)
+    chroma_retriever = chroma_retriever or create_chroma_retriever()
+    lexical_retriever = LexicalRetriever.create(chroma_retriever)
+    mongodb_retriever = MongoDBRetriever.create()
     
-    # Create ensemble retriever combining both sources
+    # Results are fused with weighted reciprocal-rank fusion. Chunks found by both the 
+    # vector and the lexical search merge into one document and rank highest. Chroma 
+    # comes first so merged chunks keep its metadata (including the distance)
     return EnsembleRetriever(
-        retrievers=[chroma_retriever, mongodb_retriever],
-        weights=[0.7, 0.3]  # 70% weight to vector DB, 30% to MongoDB
+        retrievers=[chroma_retriever, lexical_retriever, mongodb_retriever],
+        weights=[0.5, 0.3, 0.2]  # 50% vector DB, 30% lexical, 20% MongoDB
     ) 
\ No newline at end of file
@@ -0,0 +1,47 @@
+from typing import List, Any
+
+from langchain.schema import Document
+from langchain_core.retrievers import BaseRetriever
+
+from services.local_index import local_index_service
+from services.metrics import timed
+
+class LexicalRetriever(BaseRetriever):
+    """BM25 retriever over the same chunks as Chroma. Catches exact product terms, 
+    feature names and error codes that embeddings blur together"""
+    
+    chroma_retriever: Any
+    k: int
+    
+    @classmethod
+    def create(cls, chroma_retriever, k: int = 4):
+        """Factory method to create LexicalRetriever. The Chroma retriever supplies the 
+        enhanced query for the current request"""
+        return cls(
+            chroma_retriever=chroma_retriever,
+            k=k
+        )
+    
+    def _get_relevant_documents(self, query: str) -> List[Document]:
+        """Lexical search on the user's question"""
+        try:
+            with timed("lexical_search"):
+                return [doc for doc, _ in local_index_service.lexical_search(query, k=self.k)]
+        except Exception as e:
+            print(f"Lexical retriever error: {e}")
+            return []
+    
+    async def _aget_relevant_documents(self, query: str) -> List[Document]:
+        """Lexical search on the question plus its enhanced form. The enhanced query is 
+        shared with the Chroma retriever"""
+        try:
+            enhanced_query = await self.chroma_retriever.aenhance_query(query)
+            if enhanced_query != query:
+                # The user's own wording carries the exact terms - keep it
+                query = f"{query} {enhanced_query}"
+            with timed("lexical_search"):
+                results = await local_index_service.alexical_search(query, k=self.k)
+            return [doc for doc, _ in results]
+        except Exception as e:
+            print(f"Lexical retriever error: {e}")
+            return []
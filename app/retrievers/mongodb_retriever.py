@@ -1,51 +1,58 @@
-from typing import List, Any
+from typing import List
 
 from langchain.schema import Document
 from langchain_core.retrievers import BaseRetriever
 
-from services.mongodb import mongodb
+from services.session_context import current_session
 
 class MongoDBRetriever(BaseRetriever):
-    """MongoDB retriever that returns the last 5 chats for context from a specific session"""
+    """MongoDB retriever that returns the last 5 chats for context from the current session"""
     
-    mongodb_instance: Any
     limit: int
-    session_id: str
     
     @classmethod
-    def create(cls, mongodb_instance, session_id: str, limit: int = 5):
+    def create(cls, limit: int = 5):
         """Factory method to create MongoDBRetriever"""
-        return cls(mongodb_instance=mongodb_instance, session_id=session_id, limit=limit)
+        return cls(limit=limit)
+
+    def _to_documents(self, results: List[dict]) -> List[Document]:
+        """Convert chat history entries into documents"""
+        documents = []
+        for result in results:
+            # Create document from Q&A pair
+            content = (f"Previous conversation:\n"
+                      f"User: {result['question']}\n"
+                      f"Assistant: {result['answer']}")
+            doc = Document(
+                page_content=content,
+                metadata={
+                    "source": "chat_history",
+                    "timestamp": result["timestamp"],
+                    "question": result["question"],
+                    "answer": result["answer"]
+                }
+            )
+            documents.append(doc)
+        
+        return documents
 
     def _get_relevant_documents(self, query: str) -> List[Document]:
         """Return the last N chats for conversation context from specific session"""
         try:
-            # Use the sync method from MongoDB instance with session_id
-            results = self.mongodb_instance.get_chat_history_sync(self.session_id, self.limit)
-            
-            documents = []
-            for result in results:
-                # Create document from Q&A pair
-                content = (f"Previous conversation:\n"
-                          f"User: {result['question']}\n"
-                          f"Assistant: {result['answer']}")
-                doc = Document(
-                    page_content=content,
-                    metadata={
-                        "source": "chat_history",
-                        "timestamp": result["timestamp"],
-                        "question": result["question"],
-                        "answer": result["answer"]
-                    }
-                )
-                documents.append(doc)
-            
-            return documents
+            # Use the sync history read from the current session context
+            results = current_session.get().get_history_sync(self.limit)
+            return self._to_documents(results)
 
         except Exception as e:
             print(f"MongoDB Retriever Error: {e}")
             return []
 
     async def _aget_relevant_documents(self, query: str) -> List[Document]:
-        """Async version - delegates to sync version"""
-        return self._get_relevant_documents(query) 
\ No newline at end of file
+        """Async version - reads the chat history through motor"""
+        try:
+            results = await current_session.get().get_history(self.limit)
+            return self._to_documents(results)
+
+        except Exception as e:
+            print(f"MongoDB Retriever Error: {e}")
+            return [] 
\ No newline at end of file
@@ -0,0 +1,25 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+from services.articles import Article
+
+class ArticleContent(BaseModel):
+    content: Optional[str] = None
+
+class ArticleIn(BaseModel):
+    title: str
+    url: str
+    content: Optional[str] = None
+
+class BulkArticlesResponse(BaseModel):
+    # None where an article's id could not be resolved - listed again in `missing`
+    ids: List[Optional[str]]
+    missing: List[str] = []
+
+class ExpiryResponse(BaseModel):
+    deleted: int
+    ids: List[str]
+
+class ArticlePage(BaseModel):
+    articles: List[Article]
+    next_cursor: Optional[str] = None
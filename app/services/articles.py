@@ -1,10 +1,16 @@
 import os
 import uuid
 from datetime import datetime, timezone
-from typing import Optional, List
+from typing import Optional, List, Dict, Set, Tuple
 
+from cachetools import TTLCache
 from motor.motor_asyncio import AsyncIOMotorClient
 from pydantic import BaseModel
+from pymongo import ASCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from services.metrics import CACHE_LOOKUPS, timed
+from services.mongodb import uses_collection_scan
 
 class Article(BaseModel):
     id: str
@@ -12,24 +18,172 @@ class Article(BaseModel):
     url: str
     timestamp: datetime
 
+# Article ids deleted per bulk delete during expiry
+EXPIRY_BATCH_SIZE = 1000
+
 class ArticlesService:
+    # Lookups and deletes go by article id; re-ingestion matches on url; expiry and
+    # listings scan by timestamp, with id as the keyset tiebreaker
+    INDEXES = [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("url", ASCENDING)], unique=True, name="url_unique"),
+        IndexModel([("timestamp", ASCENDING), ("id", ASCENDING)], name="timestamp_id")
+    ]
+    # Fields returned by article listings
+    LISTING_PROJECTION = {"_id": 0, "id": 1, "title": 1, "url": 1, "timestamp": 1}
+
     def __init__(self):
         client = AsyncIOMotorClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
         self.articles = client.articles.documents
 
-    async def store_article(self, title: str, url: str) -> str:
-        article_id = str(uuid.uuid4())
-        article = {
-            "id": article_id,
-            "title": title,
-            "url": url,
-            "timestamp": datetime.now(timezone.utc)
+        # Optional retention mode: a TTL index on timestamp lets Mongo expire articles itself
+        retention_days = os.getenv("ARTICLE_RETENTION_DAYS")
+        self.retention_seconds = int(float(retention_days) * 86400) if retention_days else None
+
+        # Read-through cache of article id -> (title, url) for reference resolution
+        self._reference_cache = TTLCache(
+            maxsize=int(os.getenv("ARTICLE_CACHE_SIZE", "10000")),
+            ttl=int(os.getenv("ARTICLE_CACHE_TTL", "3600"))
+        )
+
+    async def _remove_duplicate_urls(self):
+        """Keep only the most recently ingested article per url - concurrent upserts before
+        url became unique could insert the same page twice"""
+        duplicates = self.articles.aggregate([
+            {"$sort": {"timestamp": -1}},
+            {"$group": {"_id": "$url", "ids": {"$push": "$id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ], allowDiskUse=True)
+        stale = []
+        async for group in duplicates:
+            stale.extend(group["ids"][1:])
+
+        for start in range(0, len(stale), EXPIRY_BATCH_SIZE):
+            await self.articles.delete_many({"id": {"$in": stale[start:start + EXPIRY_BATCH_SIZE]}})
+        if stale:
+            print(f"Removed {len(stale)} duplicate articles sharing a url: {stale}")
+
+    async def ensure_indexes(self):
+        """Create the indexes backing the article queries (no-op if they already exist)"""
+        existing = await self.articles.index_information()
+        if "url_unique" not in existing:
+            await self._remove_duplicate_urls()
+        await self.articles.create_indexes(self.INDEXES)
+        if "url" in existing:
+            # Superseded by url_unique
+            await self.articles.drop_index("url")
+        if self.retention_seconds is None and "timestamp" in existing:
+            # Superseded by timestamp_id - only retention mode still needs it
+            try:
+                await self.articles.drop_index("timestamp")
+            except OperationFailure:
+                # Dropped concurrently by another worker
+                pass
+        if self.retention_seconds is not None:
+            # TTL indexes must be single-field, so retention gets an index of its own
+            try:
+                await self.articles.create_index(
+                    [("timestamp", ASCENDING)], name="timestamp",
+                    expireAfterSeconds=self.retention_seconds
+                )
+            except OperationFailure:
+                # Already there without a TTL or with another period - update it in place
+                await self.articles.database.command(
+                    "collMod", self.articles.name,
+                    index={"name": "timestamp", "expireAfterSeconds": self.retention_seconds}
+                )
+
+    async def check_query_plans(self) -> List[str]:
+        """Explain the hot article queries and return those that fall back to a collection scan"""
+        queries = {
+            "article by id": self.articles.find({"id": ""}).limit(1),
+            "articles older than": self.articles.find({"timestamp": {"$lt": datetime.now(timezone.utc)}})
+                .sort([("timestamp", ASCENDING), ("id", ASCENDING)]).limit(10),
         }
-        await self.articles.insert_one(article)
-        return article_id
+        return [name for name, cursor in queries.items()
+                if uses_collection_scan((await cursor.explain())["queryPlanner"]["winningPlan"])]
+
+    @staticmethod
+    def _upsert_fields(title: str, content: Optional[str]) -> dict:
+        # Omitting content leaves what is stored untouched, so unchanged pages
+        # can be re-posted just to refresh their timestamp
+        fields = {"title": title, "timestamp": datetime.now(timezone.utc)}
+        if content is not None:
+            fields["content"] = content
+        return fields
+
+    async def store_article(self, title: str, url: str, content: Optional[str] = None) -> str:
+        """Store an article, keyed by url. Re-ingesting a known url keeps its id and
+        refreshes its title and timestamp"""
+        upsert = dict(
+            filter={"url": url},
+            update={
+                "$set": self._upsert_fields(title, content),
+                "$setOnInsert": {"id": str(uuid.uuid4())}
+            },
+            projection={"_id": 0, "id": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        try:
+            document = await self.articles.find_one_and_update(**upsert)
+        except DuplicateKeyError:
+            # A concurrent upsert inserted the url first - this one now updates it
+            document = await self.articles.find_one_and_update(**upsert)
+        # The title may have changed
+        self._reference_cache.pop(document["id"], None)
+        return document["id"]
+
+    async def _bulk_upsert(self, latest: Dict[str, Tuple[str, Optional[str]]]) -> Dict[str, str]:
+        """Upsert articles by url in one unordered bulk write. Returns the ids of the
+        urls that were inserted"""
+        new_ids = {url: str(uuid.uuid4()) for url in latest}
+        urls = list(latest)
+        result = await self.articles.bulk_write([
+            UpdateOne(
+                {"url": url},
+                {
+                    "$set": self._upsert_fields(title, content),
+                    "$setOnInsert": {"id": new_ids[url]}
+                },
+                upsert=True
+            )
+            for url, (title, content) in latest.items()
+        ], ordered=False)
+        return {urls[index]: new_ids[urls[index]] for index in result.upserted_ids}
+
+    async def store_articles(self, articles: List[Tuple[str, str, Optional[str]]]) -> List[Optional[str]]:
+        """Bulk version of store_article for (title, url, content) tuples: one unordered
+        bulk write plus an id lookup for urls that already existed. Returns ids in input
+        order - None for an article whose id could not be resolved (e.g. deleted meanwhile)"""
+        if not articles:
+            return []
+
+        # The last occurrence wins when a batch repeats a url
+        latest = {url: (title, content) for title, url, content in articles}
+        try:
+            ids = await self._bulk_upsert(latest)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            # Lost insert races to concurrent upserts - those urls now exist and update
+            ids = await self._bulk_upsert(latest)
+
+        existing = [url for url in latest if url not in ids]
+        if existing:
+            cursor = self.articles.find({"url": {"$in": existing}}, {"_id": 0, "id": 1, "url": 1})
+            async for document in cursor:
+                ids[document["url"]] = document["id"]
+        for article_id in ids.values():
+            self._reference_cache.pop(article_id, None)
+
+        missing = [url for url in latest if url not in ids]
+        if missing:
+            print(f"Could not resolve article ids after bulk upsert: {missing}")
+        return [ids.get(url) for _, url, _ in articles]
 
     async def get_article(self, article_id: str) -> Optional[Article]:
-        document = await self.articles.find_one({"id": article_id})
+        document = await self.articles.find_one({"id": article_id}, {"_id": 0, "content": 0})
         if document:
             return Article(
                 id=document["id"],
@@ -39,8 +193,43 @@ class ArticlesService:
             )
         return None
 
-    async def get_articles_older_than(self, timestamp: datetime, limit: int = 10, offset: int = 0) -> List[Article]:
-        cursor = self.articles.find({"timestamp": {"$lt": timestamp}}).skip(offset).limit(limit)
+    async def get_articles(self, article_ids: List[str]) -> Dict[str, Tuple[str, str]]:
+        """Resolve article ids to (title, url) with at most one query, serving cached ids from memory"""
+        found = {}
+        for article_id in article_ids:
+            cached = self._reference_cache.get(article_id)
+            if cached is not None:
+                found[article_id] = cached
+
+        missing = [article_id for article_id in article_ids if article_id not in found]
+        CACHE_LOOKUPS.labels("article", "hit").inc(len(found))
+        CACHE_LOOKUPS.labels("article", "miss").inc(len(missing))
+        if missing:
+            cursor = self.articles.find(
+                {"id": {"$in": missing}},
+                {"_id": 0, "id": 1, "title": 1, "url": 1}
+            )
+            with timed("article_lookup"):
+                async for document in cursor:
+                    reference = (document["title"], document["url"])
+                    self._reference_cache[document["id"]] = reference
+                    found[document["id"]] = reference
+
+        return found
+
+    async def get_articles_older_than(self, timestamp: datetime, limit: int = 10,
+                                      after: Optional[Tuple[datetime, str]] = None) -> List[Article]:
+        """Articles last ingested before `timestamp`, oldest first. Pages by keyset: pass the
+        (timestamp, id) of the previous page's last article as `after`"""
+        query = {"timestamp": {"$lt": timestamp}}
+        if after is not None:
+            after_timestamp, after_id = after
+            query["timestamp"]["$gte"] = after_timestamp
+            # Only ties on the boundary timestamp need the id comparison
+            query["$or"] = [{"timestamp": {"$gt": after_timestamp}}, {"id": {"$gt": after_id}}]
+        cursor = (self.articles.find(query, self.LISTING_PROJECTION)
+                  .sort([("timestamp", ASCENDING), ("id", ASCENDING)])
+                  .limit(limit))
         articles = []
         async for document in cursor:
             articles.append(Article(
@@ -51,8 +240,34 @@ class ArticlesService:
             ))
         return articles
 
+    async def expire_articles(self, cutoff: datetime) -> List[str]:
+        """Delete every article last ingested before `cutoff` with bulk deletes of
+        EXPIRY_BATCH_SIZE ids. Returns the deleted ids"""
+        expired = []
+        query = {"timestamp": {"$lt": cutoff}}
+        while True:
+            cursor = self.articles.find(query, {"_id": 0, "id": 1}).limit(EXPIRY_BATCH_SIZE)
+            batch = [document["id"] async for document in cursor]
+            if not batch:
+                return expired
+
+            # Keep the timestamp condition: an article re-ingested since the find survives
+            result = await self.articles.delete_many({"id": {"$in": batch}, **query})
+            if result.deleted_count < len(batch):
+                batch = list(set(batch) - await self.existing_ids(batch))
+
+            for article_id in batch:
+                self._reference_cache.pop(article_id, None)
+            expired.extend(batch)
+
+    async def existing_ids(self, article_ids: List[str]) -> Set[str]:
+        """The subset of `article_ids` that still exist"""
+        cursor = self.articles.find({"id": {"$in": list(article_ids)}}, {"_id": 0, "id": 1})
+        return {document["id"] async for document in cursor}
+
     async def delete_article(self, article_id: str) -> bool:
         result = await self.articles.delete_one({"id": article_id})
+        self._reference_cache.pop(article_id, None)
         return result.deleted_count > 0
 
 articles_service = ArticlesService() 
\ No newline at end of file
@@ -1,36 +1,121 @@
 from dotenv import load_dotenv
 from langchain.chains import RetrievalQA
-from langchain_openai import ChatOpenAI
-from typing import Dict, List, Any
-from pprint import pprint
+from typing import AsyncIterator, Dict, List, Any, Tuple
 
 from prompts.customer_support_prompt import support_prompt
+from retrievers.chroma_retriever import create_chroma_retriever
 from retrievers.ensemble_retriever import create_ensemble_retriever
+from services.chroma import chroma_service
+from services.llm import ANSWER_TAG, answer_llm
+from services.metrics import timed
+from services.mongodb import HISTORY_CACHE_DEPTH
+from services.semantic_cache import SEMANTIC_CACHE_ENABLED, semantic_cache
+from services.session_context import SessionContext, current_session
+from services.single_flight import response_flights
 
 load_dotenv()
 
+# Context-aware Chroma retriever - kept separately so the semantic cache can reuse its
+# query enhancement and embedding
+chroma_retriever = create_chroma_retriever()
+
+# QA chain is built once and shared by every request - the session id is passed in 
+# through the session context at invocation time
+qa_chain = RetrievalQA.from_chain_type(
+    llm=answer_llm,
+    chain_type="stuff",
+    retriever=create_ensemble_retriever(chroma_retriever),
+    chain_type_kwargs={"prompt": support_prompt},
+    return_source_documents=True  # Enable source document retrieval
+)
+
+async def _lookup_cache(question: str):
+    """Look up the semantic cache for the current session's enhanced query. Returns the 
+    cache key to store a fresh answer under and the cached response, if any"""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None, None
+
+    # The enhanced query embedding is shared with the retriever, so a miss costs nothing extra
+    try:
+        cache_key = (await chroma_retriever.aembed_query(question), chroma_service.index_version())
+    except Exception as e:
+        # Count it as a miss - the chain still answers without the cache
+        print(f"Semantic cache lookup error: {e}")
+        semantic_cache.record_miss()
+        return None, None
+    with timed("semantic_cache_lookup"):
+        return cache_key, semantic_cache.lookup(*cache_key)
+
+def _to_response(result: Dict[str, Any], cache_key) -> Dict[str, Any]:
+    """Extract answer and source documents from the QA chain output"""
+    return {
+        "answer": result["result"],
+        "source_docs": result["source_documents"],
+        "references": None,
+        "cache_key": cache_key
+    }
+
+async def _answer(question: str) -> Dict[str, Any]:
+    """Answer a question for the current session"""
+    cache_key, cached = await _lookup_cache(question)
+    if cached:
+        return {**cached, "cache_key": None}
+
+    # Run the chain asynchronously so concurrent chats don't serialize on the event loop
+    with timed("qa_chain"):
+        result = await qa_chain.ainvoke({"query": question})
+    return _to_response(result, cache_key)
+
 async def generate_response(question: str, session_id: str) -> Dict[str, Any]:
-    # Create session-aware ensemble retriever
-    session_retriever = create_ensemble_retriever(session_id)
+    """Answer a question. "references" is set only when the answer came from the semantic
+    cache; otherwise the caller formats them and hands the result to cache_response"""
+    # Chat history is loaded at most once per request and shared by both retrievers
+    token = current_session.set(SessionContext(session_id))
+    try:
+        # The answer depends only on the question and the history the pipeline reads, so
+        # identical questions in flight from sessions with the same history (typically 
+        # new ones) share one enhancement, retrieval and generation
+        history = await current_session.get().get_history(HISTORY_CACHE_DEPTH)
+        key = (" ".join(question.split()),
+               tuple((chat["question"], chat["answer"]) for chat in history))
+        response = await response_flights.run(key, lambda: _answer(question))
+    finally:
+        current_session.reset(token)
     
-    # Create QA chain with session-aware retriever
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=ChatOpenAI(temperature=0.3),  # Higher temperature for natural responses
-        chain_type="stuff",
-        retriever=session_retriever,
-        chain_type_kwargs={"prompt": support_prompt},
-        return_source_documents=True  # Enable source document retrieval
-    )
-    
-    result = qa_chain({"query": question})
-    
-    # Extract answer and source documents
-    answer = result["result"]
-    source_docs = result["source_documents"]
-    
-    pprint(source_docs)
+    # Every caller gets its own copy of the shared response
+    return dict(response)
 
-    return {
-        "answer": answer,
-        "source_docs": source_docs
-    }
\ No newline at end of file
+async def stream_response(question: str, session_id: str) -> AsyncIterator[Tuple[str, Any]]:
+    """Streaming version of generate_response. Yields ("token", text) as the answer is 
+    generated, then a single ("response", dict) shaped like generate_response's result"""
+    token = current_session.set(SessionContext(session_id))
+    try:
+        cache_key, cached = await _lookup_cache(question)
+        if cached:
+            yield "token", cached["answer"]
+            yield "response", {**cached, "cache_key": None}
+            return
+
+        async for event in qa_chain.astream_events({"query": question}, version="v2"):
+            # Only forward tokens from the answer LLM, not from query enhancement
+            if event["event"] == "on_chat_model_stream" and ANSWER_TAG in event["tags"]:
+                yield "token", event["data"]["chunk"].content
+            elif event["event"] == "on_chain_end" and not event["parent_ids"]:
+                yield "response", _to_response(event["data"]["output"], cache_key)
+    finally:
+        current_session.reset(token)
+
+def cache_response(response: Dict[str, Any], references: List[Any]):
+    """Store a freshly generated answer and its references in the semantic cache"""
+    if response["cache_key"] is None:
+        return
+    # Answers built on a session's own chat history must not be served to other sessions
+    if any(doc.metadata.get("source") == "chat_history" for doc in response["source_docs"]):
+        return
+
+    embedding, version = response["cache_key"]
+    semantic_cache.store(embedding, version, {
+        "answer": response["answer"],
+        "source_docs": response["source_docs"],
+        "references": references
+    })
\ No newline at end of file
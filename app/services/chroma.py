@@ -1,14 +1,23 @@
+import asyncio
 import os
+import threading
 import time
-from typing import List
+from typing import List, Optional, Set
 
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
 from langchain_community.embeddings import OpenAIEmbeddings
 from langchain.schema import Document
 
+from services.embedding_cache import create_cached_embeddings
+from services.index_generations import generation_path, index_version, marker_signature, read_generation
+from services.local_index import VECTOR_BACKEND, local_index_service
+from services.metrics import CHROMA_RETRIES, timed
+
 # Load environment variables
 load_dotenv()
+# Chunks fetched or deleted per Chroma call during maintenance
+MAINTENANCE_BATCH_SIZE = 1000
 
 class ChromaService:
     """Service for managing Chroma vectorstore connections with automatic recovery"""
@@ -16,63 +25,111 @@ class ChromaService:
     def __init__(self):
         self.top_dir = os.environ.get("TOP_DIR")
         self.chroma_dir_path = os.path.join(self.top_dir, os.environ.get("CHROMA_DIR"))
+        # Cached so repeated (enhanced) queries skip the OpenAI round trip - shared by 
+        # every index generation
+        self._embeddings = create_cached_embeddings(OpenAIEmbeddings())
         self._vectorstore = None
+        self._generation = None
+        self._marker_signature = None
+        self._lock = threading.Lock()
+    
+    def _marker_changed(self) -> bool:
+        """Cheap stat() check for a newly published CURRENT marker"""
+        signature = marker_signature(self.chroma_dir_path)
+        changed = signature != self._marker_signature
+        self._marker_signature = signature
+        return changed
     
-    def _create_vectorstore(self):
+    def _create_vectorstore(self, persist_directory: str):
         """Create a new Chroma vectorstore instance"""
         try:
-            print("Creating new Chroma vectorstore connection...")
+            print(f"Creating new Chroma vectorstore connection to {persist_directory}...")
             return Chroma(
-                persist_directory=self.chroma_dir_path, 
-                embedding_function=OpenAIEmbeddings()
+                persist_directory=persist_directory, 
+                embedding_function=self._embeddings
             )
         except Exception as e:
             print(f"Error creating Chroma vectorstore: {e}")
             raise
     
     def _get_vectorstore(self):
-        """Get or create the Chroma vectorstore"""
-        if self._vectorstore is None:
-            self._vectorstore = self._create_vectorstore()
-        return self._vectorstore
+        """Get the vectorstore for the current index generation. When a new generation is 
+        published, new operations switch to it while in-flight ones finish on the old one"""
+        with self._lock:
+            if self._marker_changed() or self._vectorstore is None:
+                generation = read_generation(self.chroma_dir_path)
+                if self._vectorstore is None or generation != self._generation:
+                    self._vectorstore = self._create_vectorstore(generation_path(self.chroma_dir_path, generation))
+                    self._generation = generation
+            return self._vectorstore
     
     def _reset_connection(self):
         """Reset the vectorstore to force recreation"""
-        self._vectorstore = None
+        with self._lock:
+            self._vectorstore = None
+    
+    def _should_retry(self, error: Exception, attempt: int, max_retries: int) -> bool:
+        """Decide whether a failed attempt is worth retrying, resetting the connection if so"""
+        error_msg = str(error).lower()
+        
+        # Check if it's a connection-related error
+        is_connection_error = any(keyword in error_msg for keyword in [
+            'connection', 'timeout', 'network', 'unreachable', 
+            'refused', 'broken pipe', 'closed', 'reset', 'sqlite'
+        ])
+        
+        if is_connection_error and attempt < max_retries - 1:
+            print(f"Connection error detected (attempt {attempt + 1}/{max_retries}): {error}")
+            print("Resetting vectorstore and retrying...")
+            CHROMA_RETRIES.inc()
+            
+            # Reset the vectorstore to force recreation
+            self._reset_connection()
+            return True
+        
+        # If it's not a connection error or max retries reached, re-raise
+        print(f"Chroma operation failed after {attempt + 1} attempts: {error}")
+        return False
     
     def _execute_with_retry(self, operation, max_retries=3, delay=1):
-        """Execute a Chroma operation with retry logic for connection recovery"""
+        """Execute a Chroma operation with retry logic for connection recovery. For 
+        synchronous callers only - async code uses _aexecute_with_retry"""
         for attempt in range(max_retries):
             try:
                 vectorstore = self._get_vectorstore()
                 return operation(vectorstore)
                 
             except Exception as e:
-                error_msg = str(e).lower()
-                
-                # Check if it's a connection-related error
-                is_connection_error = any(keyword in error_msg for keyword in [
-                    'connection', 'timeout', 'network', 'unreachable', 
-                    'refused', 'broken pipe', 'closed', 'reset', 'sqlite'
-                ])
+                if not self._should_retry(e, attempt, max_retries):
+                    raise
+                # Wait before retrying with linear backoff
+                time.sleep(delay * (attempt + 1))
+    
+    async def _aexecute_with_retry(self, operation, max_retries=3, delay=1):
+        """Async _execute_with_retry - each attempt runs in a worker thread and the backoff 
+        sleeps on the event loop, so neither a thread nor the loop is held while waiting"""
+        for attempt in range(max_retries):
+            try:
+                vectorstore = await asyncio.to_thread(self._get_vectorstore)
+                return await asyncio.to_thread(operation, vectorstore)
                 
-                if is_connection_error and attempt < max_retries - 1:
-                    print(f"Connection error detected (attempt {attempt + 1}/{max_retries}): {e}")
-                    print("Resetting vectorstore and retrying...")
-                    
-                    # Reset the vectorstore to force recreation
-                    self._reset_connection()
-                    
-                    # Wait before retrying with exponential backoff
-                    time.sleep(delay * (attempt + 1))
-                    continue
-                else:
-                    # If it's not a connection error or max retries reached, re-raise
-                    print(f"Chroma operation failed after {attempt + 1} attempts: {e}")
+            except Exception as e:
+                if not self._should_retry(e, attempt, max_retries):
                     raise
+                await asyncio.sleep(delay * (attempt + 1))
+    
+    def _local_vector_search(self, embedding: List[float], k: int) -> Optional[List[tuple]]:
+        """In-process search when the numpy backend is enabled and the served generation 
+        has an embedding matrix, otherwise None"""
+        if VECTOR_BACKEND != "numpy":
+            return None
+        return local_index_service.vector_search(embedding, k)
     
     def similarity_search(self, query: str, k: int = 4) -> List[Document]:
         """Perform similarity search with automatic retry on connection errors"""
+        if VECTOR_BACKEND == "numpy":
+            return self.similarity_search_by_vector(self._embeddings.embed_query(query), k)
+        
         def search_operation(vectorstore):
             return vectorstore.similarity_search(query, k=k)
         
@@ -80,10 +137,117 @@ class ChromaService:
     
     def similarity_search_with_score(self, query: str, k: int = 4) -> List[tuple]:
         """Perform similarity search with scores and automatic retry on connection errors"""
+        if VECTOR_BACKEND == "numpy":
+            return self.similarity_search_by_vector_with_score(self._embeddings.embed_query(query), k)
+        
         def search_operation(vectorstore):
             return vectorstore.similarity_search_with_score(query, k=k)
         
         return self._execute_with_retry(search_operation)
 
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4) -> List[Document]:
+        """Perform similarity search for a precomputed query embedding with automatic retry"""
+        results = self._local_vector_search(embedding, k)
+        if results is not None:
+            return [doc for doc, _ in results]
+        
+        def search_operation(vectorstore):
+            return vectorstore.similarity_search_by_vector(embedding, k=k)
+        
+        return self._execute_with_retry(search_operation)
+
+    @staticmethod
+    def _search_by_vector_with_score_operation(embedding: List[float], k: int):
+        def search_operation(vectorstore):
+            # Despite its name, Chroma returns raw distances here (lower is more similar)
+            return vectorstore.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+        return search_operation
+
+    @staticmethod
+    def _delete_sources_operation(sources: List[str]):
+        def delete_operation(vectorstore):
+            for start in range(0, len(sources), MAINTENANCE_BATCH_SIZE):
+                batch = sources[start:start + MAINTENANCE_BATCH_SIZE]
+                ids = vectorstore.get(where={"source": {"$in": batch}}, include=[])["ids"]
+                if ids:
+                    vectorstore.delete(ids=ids)
+        return delete_operation
+
+    @staticmethod
+    def _sources_operation(vectorstore) -> Set[str]:
+        sources = set()
+        offset = 0
+        while True:
+            metadatas = vectorstore.get(include=["metadatas"], limit=MAINTENANCE_BATCH_SIZE,
+                                        offset=offset)["metadatas"]
+            sources.update(metadata["source"] for metadata in metadatas if metadata)
+            if len(metadatas) < MAINTENANCE_BATCH_SIZE:
+                return sources
+            offset += MAINTENANCE_BATCH_SIZE
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[tuple]:
+        """Perform similarity search with distances for a precomputed query embedding"""
+        results = self._local_vector_search(embedding, k)
+        if results is not None:
+            return results
+        
+        return self._execute_with_retry(self._search_by_vector_with_score_operation(embedding, k))
+
+    def delete_sources(self, sources: List[str]):
+        """Remove every chunk of the given articles from the served index generation.
+        The next build copies this generation, so the deletion carries over"""
+        if sources:
+            self._execute_with_retry(self._delete_sources_operation(sources))
+
+    def sources(self) -> Set[str]:
+        """Ids of every article with chunks in the served index generation"""
+        return self._execute_with_retry(self._sources_operation)
+
+    def index_generation(self) -> Optional[str]:
+        """Current index generation - changes every time create_embeddings.py publishes a build"""
+        return read_generation(self.chroma_dir_path)
+
+    def index_version(self) -> tuple:
+        """Current generation and its expired articles - answers cached under an older 
+        version may cite articles that are gone"""
+        return index_version(self.chroma_dir_path)
+
+    async def aembed_query(self, query: str) -> List[float]:
+        """Embed a query with the async OpenAI client"""
+        with timed("embedding"):
+            return await self._embeddings.aembed_query(query)
+
+    async def asimilarity_search(self, query: str, k: int = 4) -> List[Document]:
+        """Async similarity search - embeds the query with the async OpenAI client and 
+        runs the local Chroma lookup in a worker thread so the event loop never blocks"""
+        embedding = await self.aembed_query(query)
+        return [doc for doc, _ in await self.asimilarity_search_by_vector_with_score(embedding, k)]
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4) -> List[tuple]:
+        """Async similarity search returning (document, distance) pairs"""
+        embedding = await self.aembed_query(query)
+        return await self.asimilarity_search_by_vector_with_score(embedding, k)
+
+    async def asimilarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[tuple]:
+        """Async similarity search with distances for a precomputed query embedding. Both 
+        backends search in a worker thread so the event loop never blocks"""
+        with timed("vector_search"):
+            if VECTOR_BACKEND == "numpy":
+                results = await local_index_service.avector_search(embedding, k)
+                if results is not None:
+                    return results
+            return await self._aexecute_with_retry(
+                self._search_by_vector_with_score_operation(embedding, k)
+            )
+
+    async def adelete_sources(self, sources: List[str]):
+        """Async delete_sources - runs in a worker thread"""
+        if sources:
+            await self._aexecute_with_retry(self._delete_sources_operation(sources))
+
+    async def asources(self) -> Set[str]:
+        """Async sources - runs in a worker thread"""
+        return await self._aexecute_with_retry(self._sources_operation)
+
 # Global service instance
 chroma_service = ChromaService() 
\ No newline at end of file
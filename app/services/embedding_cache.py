@@ -0,0 +1,80 @@
+import os
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from cachetools import LRUCache
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_core.embeddings import Embeddings
+from langchain_core.stores import ByteStore
+
+from services.metrics import CACHE_LOOKUPS
+
+class LRUByteStore(ByteStore):
+    """Bounded in-memory byte store, optionally layered over a persistent store"""
+
+    def __init__(self, maxsize: int, backing_store: Optional[ByteStore] = None):
+        self._memory = LRUCache(maxsize=maxsize)
+        self._backing_store = backing_store
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        values = [self._memory.get(key) for key in keys]
+
+        # Fall back to the persistent store for memory misses and promote what it has
+        missing = [i for i, value in enumerate(values) if value is None]
+        CACHE_LOOKUPS.labels("embedding", "hit").inc(len(keys) - len(missing))
+        if missing and self._backing_store is not None:
+            stored = self._backing_store.mget([keys[i] for i in missing])
+            for i, value in zip(missing, stored):
+                if value is not None:
+                    self._memory[keys[i]] = value
+                    values[i] = value
+                    CACHE_LOOKUPS.labels("embedding", "disk_hit").inc()
+
+        CACHE_LOOKUPS.labels("embedding", "miss").inc(sum(value is None for value in values))
+        return values
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, bytes]]) -> None:
+        for key, value in key_value_pairs:
+            self._memory[key] = value
+        if self._backing_store is not None:
+            self._backing_store.mset(key_value_pairs)
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        for key in keys:
+            self._memory.pop(key, None)
+        if self._backing_store is not None:
+            self._backing_store.mdelete(keys)
+
+    def yield_keys(self, prefix: Optional[str] = None) -> Iterator[str]:
+        if self._backing_store is not None:
+            yield from self._backing_store.yield_keys(prefix=prefix)
+            return
+        for key in list(self._memory):
+            if prefix is None or key.startswith(prefix):
+                yield key
+
+    async def amget(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        # Pure memory hits don't need a trip through the thread pool
+        if self._backing_store is None:
+            return self.mget(keys)
+        return await super().amget(keys)
+
+    async def amset(self, key_value_pairs: Sequence[Tuple[str, bytes]]) -> None:
+        if self._backing_store is None:
+            return self.mset(key_value_pairs)
+        return await super().amset(key_value_pairs)
+
+def create_cached_embeddings(underlying: Embeddings) -> Embeddings:
+    """Wrap an embedding model with an LRU cache (plus an on-disk store when
+    EMBEDDING_CACHE_DIR is set) keyed by model name and text hash"""
+    cache_dir = os.getenv("EMBEDDING_CACHE_DIR")
+    store = LRUByteStore(
+        maxsize=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+        backing_store=LocalFileStore(cache_dir) if cache_dir else None
+    )
+    return CacheBackedEmbeddings.from_bytes_store(
+        underlying,
+        store,
+        namespace=getattr(underlying, "model", type(underlying).__name__),
+        query_embedding_cache=True
+    )
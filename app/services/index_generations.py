@@ -0,0 +1,42 @@
+import os
+from typing import Optional
+
+# Versioned index layout written by create_embeddings.py: each build lives in 
+# generations/<id>/ and the CURRENT file names the one to serve
+CURRENT_GENERATION_FILE = "CURRENT"
+GENERATIONS_DIR = "generations"
+# Articles expired since a generation was built, recorded inside it by the backend
+DELETED_SOURCES_FILE = "deleted_sources.json"
+
+def read_generation(index_dir_path: str) -> Optional[str]:
+    """Generation named by the CURRENT marker, or None for a legacy single-directory index"""
+    try:
+        with open(os.path.join(index_dir_path, CURRENT_GENERATION_FILE)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def generation_path(index_dir_path: str, generation: Optional[str]) -> str:
+    """Directory holding the index data of a generation"""
+    if generation is None:
+        return index_dir_path
+    return os.path.join(index_dir_path, GENERATIONS_DIR, generation)
+
+def file_signature(path: str) -> Optional[tuple]:
+    """Cheap stat() signature of a file that is replaced atomically, or None if missing"""
+    try:
+        stat = os.stat(path)
+        return (stat.st_ino, stat.st_mtime_ns)
+    except OSError:
+        return None
+
+def marker_signature(index_dir_path: str) -> Optional[tuple]:
+    """Signature of the CURRENT marker - changes whenever a generation is published"""
+    return file_signature(os.path.join(index_dir_path, CURRENT_GENERATION_FILE))
+
+def index_version(index_dir_path: str) -> tuple:
+    """Current generation plus the signature of its expired-articles file - changes on 
+    every publish and on every expiry, whichever worker handled it"""
+    generation = read_generation(index_dir_path)
+    deleted = os.path.join(generation_path(index_dir_path, generation), DELETED_SOURCES_FILE)
+    return generation, file_signature(deleted)
@@ -0,0 +1,182 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+
+from services.metrics import LLM_REJECTIONS, LLMMetricsHandler
+
+load_dotenv()
+
+# Shared connection pools so every LLM call reuses warm TLS connections to OpenAI
+# instead of paying a handshake for each new client
+_limits = httpx.Limits(max_connections=200, max_keepalive_connections=50)
+http_client = httpx.Client(limits=_limits)
+http_async_client = httpx.AsyncClient(limits=_limits)
+
+# Tag identifying answer generation in streamed events
+ANSWER_TAG = "answer"
+
+class LLMUnavailable(Exception):
+    """An LLM call was not made or not finished in time - callers degrade or answer 503"""
+
+class LLMOverloaded(LLMUnavailable):
+    """Shed on admission: too many calls already waiting for a slot"""
+
+class LLMTimeout(LLMUnavailable):
+    """The call (including its wait for a slot) ran past its deadline"""
+
+class PurposeLimits:
+    """Concurrency, queue depth and deadline of one kind of LLM call"""
+
+    def __init__(self, purpose: str, concurrency: int, max_queue: int, timeout: float):
+        prefix = f"LLM_{purpose.upper()}"
+        self.concurrency = int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrency)))
+        self.max_queue = int(os.getenv(f"{prefix}_MAX_QUEUE", str(max_queue)))
+        self.timeout = float(os.getenv(f"{prefix}_TIMEOUT", str(timeout)))
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.waiting = 0
+
+class LLMGateway:
+    """Admission control for every async LLM call: a global and a per-purpose concurrency
+    limit, a bounded wait queue that sheds excess calls at once, and a per-call deadline.
+    Under overload callers fail fast instead of piling up behind a slow upstream"""
+
+    def __init__(self, max_concurrency: int, purposes: Dict[str, PurposeLimits]):
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._purposes = purposes
+
+    def _reject(self, purpose: str, reason: str, error: LLMUnavailable) -> LLMUnavailable:
+        LLM_REJECTIONS.labels(purpose, reason).inc()
+        return error
+
+    async def _acquire(self, limits: PurposeLimits):
+        await limits.semaphore.acquire()
+        try:
+            await self._global.acquire()
+        except BaseException:
+            limits.semaphore.release()
+            raise
+
+    @asynccontextmanager
+    async def _admit(self, purpose: str, deadline: float):
+        """Hold a global and a per-purpose slot, waiting for them no later than `deadline`"""
+        limits = self._purposes[purpose]
+        if not limits.semaphore.locked() and not self._global.locked():
+            # Free slots are taken without suspending
+            await self._acquire(limits)
+        elif limits.waiting >= limits.max_queue:
+            raise self._reject(purpose, "queue_full",
+                               LLMOverloaded(f"{limits.waiting} {purpose} LLM calls already waiting"))
+        else:
+            limits.waiting += 1
+            try:
+                await asyncio.wait_for(self._acquire(limits), _remaining(deadline))
+            except asyncio.TimeoutError:
+                raise self._reject(purpose, "deadline",
+                                   LLMTimeout(f"No {purpose} LLM slot within {limits.timeout}s"))
+            finally:
+                limits.waiting -= 1
+
+        try:
+            yield
+        finally:
+            self._global.release()
+            limits.semaphore.release()
+
+    def _deadline(self, purpose: str) -> float:
+        return asyncio.get_running_loop().time() + self._purposes[purpose].timeout
+
+    async def call(self, purpose: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Run one LLM call under the purpose's limits and deadline"""
+        deadline = self._deadline(purpose)
+        async with self._admit(purpose, deadline):
+            try:
+                return await asyncio.wait_for(factory(), _remaining(deadline))
+            except asyncio.TimeoutError:
+                raise self._reject(purpose, "deadline",
+                                   LLMTimeout(f"{purpose} LLM call exceeded its deadline"))
+
+    async def stream(self, purpose: str, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Streaming version of call - the slot is held and the deadline enforced until
+        the last chunk"""
+        deadline = self._deadline(purpose)
+        async with self._admit(purpose, deadline):
+            iterator = factory()
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), _remaining(deadline))
+                    except StopAsyncIteration:
+                        return
+                    except asyncio.TimeoutError:
+                        raise self._reject(purpose, "deadline",
+                                           LLMTimeout(f"{purpose} LLM stream exceeded its deadline"))
+                    yield chunk
+            finally:
+                await iterator.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            purpose: {
+                "concurrency": limits.concurrency,
+                "waiting": limits.waiting,
+                "max_queue": limits.max_queue
+            }
+            for purpose, limits in self._purposes.items()
+        }
+
+def _remaining(deadline: float) -> float:
+    return max(0.0, deadline - asyncio.get_running_loop().time())
+
+# Shared by every chat model. Answer calls are slow and few per request; utility calls
+# (query enhancement, relevance grading) are quick and fan out
+llm_gateway = LLMGateway(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "64")),
+    purposes={
+        "answer": PurposeLimits("answer", concurrency=32, max_queue=64, timeout=30),
+        "utility": PurposeLimits("utility", concurrency=48, max_queue=96, timeout=10)
+    }
+)
+
+class GatewayChatOpenAI(ChatOpenAI):
+    """ChatOpenAI whose async calls go through the LLM gateway under `purpose`"""
+
+    purpose: str
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        generate = super()._agenerate
+        return await llm_gateway.call(
+            self.purpose, lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        )
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        stream = super()._astream
+        async for chunk in llm_gateway.stream(
+            self.purpose, lambda: stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        ):
+            yield chunk
+
+def create_chat_model(temperature: float, purpose: str, tags: Optional[List[str]] = None) -> ChatOpenAI:
+    """Create a ChatOpenAI client backed by the shared connection pools and gated by the
+    LLM gateway. Latency and token usage are recorded under `purpose`"""
+    return GatewayChatOpenAI(
+        temperature=temperature,
+        purpose=purpose,
+        tags=tags,
+        callbacks=[LLMMetricsHandler(purpose)],
+        # Report token usage for streamed answers too
+        stream_usage=True,
+        http_client=http_client,
+        http_async_client=http_async_client
+    )
+
+# LLM for answer generation - higher temperature for natural responses
+answer_llm = create_chat_model(0.3, "answer", tags=[ANSWER_TAG])
+
+# LLM for query enhancement and relevance checking
+utility_llm = create_chat_model(0.1, "utility")
@@ -0,0 +1,261 @@
+import asyncio
+import json
+import os
+import re
+import threading
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain.schema import Document
+
+from services.index_generations import (DELETED_SOURCES_FILE, file_signature, generation_path,
+                                        marker_signature, read_generation)
+
+# Load environment variables
+load_dotenv()
+
+# In-process indexes written by create_embeddings.py inside each index generation.
+# Rows of every index follow the order of the chunk table
+CHUNKS_FILE = "chunks.json"
+LEXICAL_INDEX_DIR = "bm25"
+VECTOR_INDEX_DIR = "vectors"
+
+# "chroma" searches through Chroma/SQLite; "numpy" searches the generation's memory-mapped 
+# embedding matrix in process and falls back to Chroma for builds without one
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+# Embedding matrix served by the numpy vector backend: "float32", or "int8" for a
+# quarter of the memory at some cost in speed and precision
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "float32").lower()
+# Rows dequantized per block when scoring the int8 matrix
+INT8_BLOCK_SIZE = 4096
+
+# Marker signature before the first load - differs from every real signature, including None
+_NOT_LOADED = object()
+
+class ChunkTable:
+    """Chunk texts and article ids of a generation, plus a mask of chunks whose article
+    has been expired since the build"""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, CHUNKS_FILE), encoding="utf-8") as f:
+            chunks = json.load(f)
+        self.sources = np.asarray(chunks["sources"], dtype=object)
+        self.texts = chunks["texts"]
+        self.live = np.ones(len(self.texts), dtype=bool)
+
+    def exclude(self, sources: Set[str]):
+        """Hide every chunk of the given articles"""
+        self.live &= ~np.isin(self.sources, list(sources))
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.texts[row], metadata={"source": self.sources[row]})
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Rows of the k highest scores, best first"""
+    if k < len(scores):
+        rows = np.argpartition(-scores, k)[:k]
+    else:
+        rows = np.arange(len(scores))
+    return rows[np.argsort(-scores[rows])]
+
+class BM25Index:
+    """Read-only BM25 index. Postings are memory-mapped and carry precomputed term
+    weights, so scoring a query is one scatter-add per query term"""
+
+    def __init__(self, path: str, chunks: ChunkTable):
+        self._chunks = chunks
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self._tokenizer = re.compile(json.load(f)["token_pattern"])
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            self._vocab = json.load(f)
+
+        self._offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self._postings = np.load(os.path.join(path, "postings.npy"), mmap_mode="r")
+        self._weights = np.load(os.path.join(path, "weights.npy"), mmap_mode="r")
+
+    def search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        """Top-k chunks by BM25 score, best first. Chunks sharing no term with the query
+        are never returned"""
+        term_ids = {self._vocab[token] for token in self._tokenizer.findall(query.lower())
+                    if token in self._vocab}
+        if not term_ids:
+            return []
+
+        scores = np.zeros(len(self._chunks), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            # A term's postings list each chunk once, so fancy-index += is safe
+            scores[self._postings[start:end]] += self._weights[start:end]
+        scores[~self._chunks.live] = 0
+
+        return [(self._chunks.document(row), float(scores[row]))
+                for row in top_k(scores, k) if scores[row] > 0]
+
+class VectorIndex:
+    """Exact nearest-neighbour search over a memory-mapped matrix of unit-length chunk
+    embeddings. Pages are shared read-only by every worker process mapping the file"""
+
+    def __init__(self, path: str, chunks: ChunkTable, quantization: str = "float32"):
+        self._chunks = chunks
+        self._quantization = quantization
+        if quantization == "int8":
+            self._matrix = np.load(os.path.join(path, "embeddings_int8.npy"), mmap_mode="r")
+            self._scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r")
+        else:
+            self._matrix = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+
+    def _similarities(self, query: np.ndarray) -> np.ndarray:
+        if self._quantization != "int8":
+            return self._matrix @ query
+        similarities = np.empty(len(self._matrix), dtype=np.float32)
+        for start in range(0, len(self._matrix), INT8_BLOCK_SIZE):
+            block = self._matrix[start:start + INT8_BLOCK_SIZE].astype(np.float32)
+            similarities[start:start + INT8_BLOCK_SIZE] = block @ query
+        return similarities * self._scales
+
+    def search(self, embedding: List[float], k: int) -> List[Tuple[Document, float]]:
+        """Top-k chunks with their distance, nearest first. Distances are squared L2 between
+        unit vectors (2 - 2 * cosine), the same scale Chroma reports"""
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        similarities = self._similarities(query)
+        similarities[~self._chunks.live] = -np.inf
+
+        return [(self._chunks.document(row), float(2 - 2 * similarities[row]))
+                for row in top_k(similarities, k) if np.isfinite(similarities[row])]
+
+class GenerationIndexes:
+    """In-process indexes of one generation. Missing ones (older builds) are None"""
+
+    def __init__(self, path: str, load_vectors: bool):
+        self.path = path
+        self.chunks = None
+        self.lexical = None
+        self.vectors = None
+        self.deleted_signature = None
+
+        try:
+            self.chunks = ChunkTable(path)
+        except OSError:
+            print(f"No chunk table at {path} - in-process indexes disabled until the next build")
+            return
+
+        try:
+            self.lexical = BM25Index(os.path.join(path, LEXICAL_INDEX_DIR), self.chunks)
+        except OSError:
+            print(f"No lexical index at {path} - lexical retrieval disabled until the next build")
+
+        if load_vectors:
+            try:
+                self.vectors = VectorIndex(os.path.join(path, VECTOR_INDEX_DIR), self.chunks,
+                                           VECTOR_QUANTIZATION)
+            except OSError:
+                print(f"No vector matrix at {path} - vector search falls back to Chroma")
+
+        print(f"Loaded in-process indexes from {path}")
+
+class LocalIndexService:
+    """Serves the in-process (lexical and vector) indexes of the current index generation,
+    switching to a new one when create_embeddings.py publishes it"""
+
+    def __init__(self, index_dir_path: str, load_vectors: bool):
+        self.index_dir_path = index_dir_path
+        self.load_vectors = load_vectors
+        self._indexes = None
+        self._generation = None
+        self._marker_signature = _NOT_LOADED
+        self._lock = threading.Lock()
+
+    def _apply_deleted_sources(self, indexes: GenerationIndexes):
+        """Pick up articles expired by any worker since the indexes were loaded"""
+        path = os.path.join(indexes.path, DELETED_SOURCES_FILE)
+        signature = file_signature(path)
+        if signature != indexes.deleted_signature:
+            indexes.deleted_signature = signature
+            if signature is not None:
+                with open(path, encoding="utf-8") as f:
+                    indexes.chunks.exclude(set(json.load(f)))
+
+    def _get_indexes(self) -> Optional[GenerationIndexes]:
+        """Indexes of the current generation - two stat() calls when nothing changed"""
+        with self._lock:
+            signature = marker_signature(self.index_dir_path)
+            if signature != self._marker_signature:
+                self._marker_signature = signature
+                generation = read_generation(self.index_dir_path)
+                if self._indexes is None or generation != self._generation:
+                    self._indexes = GenerationIndexes(
+                        generation_path(self.index_dir_path, generation), self.load_vectors
+                    )
+                    self._generation = generation
+            if self._indexes.chunks is None:
+                return None
+            self._apply_deleted_sources(self._indexes)
+            return self._indexes
+
+    def lexical_search(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        """BM25 search over the chunks of the current generation"""
+        indexes = self._get_indexes()
+        if indexes is None or indexes.lexical is None:
+            return []
+        return indexes.lexical.search(query, k)
+
+    async def alexical_search(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        """Async lexical_search - runs in a worker thread, where loading a newly published 
+        generation can't stall the event loop"""
+        return await asyncio.to_thread(self.lexical_search, query, k)
+
+    def vector_search(self, embedding: List[float], k: int = 4) -> Optional[List[Tuple[Document, float]]]:
+        """Exact vector search over the current generation, or None if it has no matrix"""
+        indexes = self._get_indexes()
+        if indexes is None or indexes.vectors is None:
+            return None
+        return indexes.vectors.search(embedding, k)
+
+    async def avector_search(self, embedding: List[float], k: int = 4) -> Optional[List[Tuple[Document, float]]]:
+        """Async vector_search - runs in a worker thread. A full scan of the matrix takes
+        milliseconds, and the first search after a new generation is published also loads it"""
+        return await asyncio.to_thread(self.vector_search, embedding, k)
+
+    def delete_sources(self, sources: List[str]):
+        """Record expired articles next to the current indexes so every worker stops
+        returning their chunks and cached answers citing them. The next build drops them 
+        for good"""
+        if not sources:
+            return
+        # Recorded even for builds without in-process indexes - it also versions the 
+        # semantic cache
+        indexes = self._get_indexes()
+
+        with self._lock:
+            path = os.path.join(self._indexes.path, DELETED_SOURCES_FILE)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    deleted = set(json.load(f))
+            except OSError:
+                deleted = set()
+            deleted.update(sources)
+
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(sorted(deleted), f)
+            os.replace(path + ".tmp", path)
+            if indexes is not None:
+                indexes.chunks.exclude(deleted)
+
+    async def adelete_sources(self, sources: List[str]):
+        """Async delete_sources - runs in a worker thread"""
+        if sources:
+            await asyncio.to_thread(self.delete_sources, sources)
+
+# Global service instance - reads the same index directory as Chroma
+local_index_service = LocalIndexService(
+    os.path.join(os.environ.get("TOP_DIR", ""), os.environ.get("CHROMA_DIR", "")),
+    load_vectors=VECTOR_BACKEND == "numpy"
+)
@@ -0,0 +1,113 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from prometheus_client import Counter, Histogram
+
+# Requests slower than this log their per-stage spans as one JSON line
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "5"))
+
+# Sub-millisecond in-process lookups up to multi-second LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30)
+
+REQUEST_LATENCY = Histogram(
+    "chatbot_http_request_duration_seconds", "HTTP request latency",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    "chatbot_stage_duration_seconds", "Latency of each chat pipeline stage",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "chatbot_llm_tokens_total", "Tokens used by LLM calls", ["purpose", "kind"]
+)
+LLM_ERRORS = Counter(
+    "chatbot_llm_errors_total", "Failed LLM calls", ["purpose"]
+)
+LLM_REJECTIONS = Counter(
+    "chatbot_llm_rejections_total", "LLM calls shed by the gateway", ["purpose", "reason"]
+)
+CACHE_LOOKUPS = Counter(
+    "chatbot_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"]
+)
+COALESCED_REQUESTS = Counter(
+    "chatbot_coalesced_requests_total", "Requests that joined an identical in-flight computation",
+    ["flight"]
+)
+CHROMA_RETRIES = Counter(
+    "chatbot_chroma_retries_total", "Chroma operations retried after a connection error"
+)
+
+# Spans of the request being served, when it is traced
+current_spans: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("current_spans", default=None)
+
+@contextmanager
+def timed(stage: str):
+    """Time a pipeline stage into the stage histogram and the current request's spans"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage).observe(duration)
+        spans = current_spans.get()
+        if spans is not None:
+            spans.append({"stage": stage, "duration": round(duration, 6)})
+
+@contextmanager
+def trace_request(endpoint: str, **fields):
+    """Collect the spans of one request (including those of tasks it spawns) and log them
+    if the request is slow"""
+    spans = []
+    token = current_spans.set(spans)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current_spans.reset(token)
+        duration = time.perf_counter() - start
+        if duration >= SLOW_REQUEST_SECONDS:
+            print(json.dumps({
+                "event": "slow_request",
+                "endpoint": endpoint,
+                "duration": round(duration, 6),
+                **fields,
+                "spans": spans
+            }, default=str))
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """Records latency, token usage and errors of every call made by one LLM client"""
+
+    # Update metrics on the calling thread instead of a callback executor
+    run_inline = True
+
+    def __init__(self, purpose: str):
+        self.purpose = purpose
+        self.stage = f"llm_{purpose}"
+        self._started: Dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        start = self._started.pop(run_id, None)
+        if start is not None:
+            STAGE_LATENCY.labels(self.stage).observe(time.perf_counter() - start)
+
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    LLM_TOKENS.labels(self.purpose, "input").inc(usage.get("input_tokens", 0))
+                    LLM_TOKENS.labels(self.purpose, "output").inc(usage.get("output_tokens", 0))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._started.pop(run_id, None)
+        LLM_ERRORS.labels(self.purpose).inc()
@@ -1,11 +1,38 @@
 import os
 from datetime import datetime, timezone
-from typing import List
+from typing import List, Optional, Tuple
 
+from bson import ObjectId
+from cachetools import TTLCache
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import MongoClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
+from pymongo.errors import OperationFailure
+
+from services.metrics import CACHE_LOOKUPS, timed
+
+# Most recent chats kept per session in the in-process history cache
+HISTORY_CACHE_DEPTH = 5
+
+def uses_collection_scan(plan) -> bool:
+    """Check whether an explain() plan contains a full collection scan"""
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(uses_collection_scan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(uses_collection_scan(value) for value in plan)
+    return False
 
 class MongoDB:
+    # History reads filter on session_id and sort on timestamp, with _id as the keyset
+    # tiebreaker; deletes filter on session_id
+    INDEXES = [
+        IndexModel([("session_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+                   name="session_id_timestamp_id")
+    ]
+    # Fields history readers use
+    HISTORY_PROJECTION = {"question": 1, "answer": 1, "session_id": 1, "timestamp": 1}
+
     def __init__(self):
         # Create clients locally
         async_client = AsyncIOMotorClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
@@ -15,6 +42,32 @@ class MongoDB:
         self.chats = async_client.chatbot.chats  # Async collection for API operations
         self.sync_chats = sync_client.chatbot.chats  # Sync collection for retriever operations
 
+        # Per-session LRU of recent history (newest first), kept current by store_chat.
+        # The TTL bounds staleness when another worker writes to the same session
+        self._recent_history = TTLCache(
+            maxsize=int(os.getenv("HISTORY_CACHE_SIZE", "10000")),
+            ttl=int(os.getenv("HISTORY_CACHE_TTL", "300"))
+        )
+
+    async def ensure_indexes(self):
+        """Create the indexes backing the chat queries (no-op if they already exist)"""
+        await self.chats.create_indexes(self.INDEXES)
+        try:
+            # Superseded by session_id_timestamp_id
+            await self.chats.drop_index("session_id_timestamp")
+        except OperationFailure:
+            # Never created or already dropped
+            pass
+
+    async def check_query_plans(self) -> List[str]:
+        """Explain the hot chat queries and return those that fall back to a collection scan"""
+        queries = {
+            "chat history": self.chats.find({"session_id": ""})
+                .sort([("timestamp", DESCENDING), ("_id", DESCENDING)]).limit(10),
+        }
+        return [name for name, cursor in queries.items()
+                if uses_collection_scan((await cursor.explain())["queryPlanner"]["winningPlan"])]
+
     async def store_chat(self, question: str, answer: str, session_id: str):
         chat_document = {
             "question": question,
@@ -22,12 +75,43 @@ class MongoDB:
             "session_id": session_id,
             "timestamp": datetime.now(timezone.utc)
         }
-        await self.chats.insert_one(chat_document)
+        with timed("store_chat"):
+            await self.chats.insert_one(chat_document)
+
+        # Keep warm sessions warm so the next question needs no history read
+        cached = self._recent_history.get(session_id)
+        if cached is not None:
+            self._recent_history[session_id] = [chat_document] + cached[:HISTORY_CACHE_DEPTH - 1]
+
+    async def get_recent_history(self, session_id: str, limit: int = HISTORY_CACHE_DEPTH):
+        """Most recent chats for a session (newest first), served from the history cache when warm"""
+        if limit > HISTORY_CACHE_DEPTH:
+            return await self.get_chat_history(session_id, limit)
+
+        history = self._recent_history.get(session_id)
+        if history is None:
+            CACHE_LOOKUPS.labels("history", "miss").inc()
+            history = await self.get_chat_history(session_id, HISTORY_CACHE_DEPTH)
+            self._recent_history[session_id] = history
+        else:
+            CACHE_LOOKUPS.labels("history", "hit").inc()
+        return history[:limit]
 
-    async def get_chat_history(self, session_id: str, limit: int = 10):
+    async def get_chat_history(self, session_id: str, limit: int = 10,
+                               before: Optional[Tuple[datetime, ObjectId]] = None):
+        """Chats for a session, newest first. Pages by keyset: pass the (timestamp, _id) of
+        the previous page's last chat as `before`"""
         query = {"session_id": session_id}
-        cursor = self.chats.find(query).sort("timestamp", -1).limit(limit)
-        return await cursor.to_list(length=limit)
+        if before is not None:
+            before_timestamp, before_id = before
+            query["timestamp"] = {"$lte": before_timestamp}
+            # Only ties on the boundary timestamp need the _id comparison
+            query["$or"] = [{"timestamp": {"$lt": before_timestamp}}, {"_id": {"$lt": before_id}}]
+        cursor = (self.chats.find(query, self.HISTORY_PROJECTION)
+                  .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+                  .limit(limit))
+        with timed("history_read"):
+            return await cursor.to_list(length=limit)
 
     def get_chat_history_sync(self, session_id: str, limit: int = 10):
         """Synchronous version of get_chat_history for retriever operations"""
@@ -35,8 +119,9 @@ class MongoDB:
             query = {"session_id": session_id}
             pipeline = [
                 {"$match": query},
-                {"$sort": {"timestamp": -1}},
-                {"$limit": limit}
+                {"$sort": {"timestamp": -1, "_id": -1}},
+                {"$limit": limit},
+                {"$project": self.HISTORY_PROJECTION}
             ]
             
             results = list(self.sync_chats.aggregate(pipeline))
@@ -48,6 +133,7 @@ class MongoDB:
     async def delete_chats_by_session(self, session_id: str):
         """Delete all chats for a specific session"""
         result = await self.chats.delete_many({"session_id": session_id})
+        self._recent_history.pop(session_id, None)
         return result.deleted_count
 
 mongodb = MongoDB()
@@ -0,0 +1,18 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+
+# Largest page a listing endpoint returns
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(timestamp: datetime, key: str) -> str:
+    """Opaque keyset cursor for the (timestamp, key) position of the last item on a page"""
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{key}".encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Inverse of encode_cursor. Raises ValueError for malformed cursors"""
+    try:
+        timestamp, key = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), key
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {e}") from e
@@ -0,0 +1,140 @@
+import itertools
+import os
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+from cachetools import Cache, TTLCache
+
+from services.metrics import CACHE_LOOKUPS
+
+class _RowCache(TTLCache):
+    """TTL/LRU map of entry key -> (matrix row, response) that hands the row back to
+    `release` whenever an entry leaves, whether deleted, evicted or expired"""
+
+    def __init__(self, maxsize: int, ttl: int, release: Callable[[int], None]):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._release = release
+
+    def __delitem__(self, key):
+        row, _ = Cache.__getitem__(self, key)
+        try:
+            super().__delitem__(key)
+        finally:
+            self._release(row)
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for _, (row, _) in expired:
+            self._release(row)
+        return expired
+
+class SemanticCache:
+    """Answer cache keyed by query embedding. A lookup hits when a cached query is at
+    least `threshold` cosine-similar to the new one. Embeddings live in one preallocated
+    matrix whose rows are reused as entries come and go, so a lookup is a single matmul"""
+
+    def __init__(self, threshold: float, maxsize: int, ttl: int):
+        self.threshold = threshold
+        self._maxsize = maxsize
+        self._entries = _RowCache(maxsize, ttl, self._release_row)
+        self._keys = itertools.count()
+        self._version = None
+        # Allocated on the first store, once the embedding size is known
+        self._matrix: Optional[np.ndarray] = None
+        self._live = np.zeros(maxsize, dtype=bool)
+        self._row_keys: List[Optional[int]] = [None] * maxsize
+        self._free_rows: List[int] = []
+        self._rows_used = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _release_row(self, row: int):
+        self._live[row] = False
+        self._row_keys[row] = None
+        self._free_rows.append(row)
+
+    def _take_row(self) -> int:
+        if not self._free_rows and self._rows_used == self._maxsize:
+            # Full - evict the least recently used entry, which frees its row
+            self._entries.popitem()
+        if self._free_rows:
+            return self._free_rows.pop()
+        self._rows_used += 1
+        return self._rows_used - 1
+
+    def _sync_version(self, version: Hashable):
+        """Drop every entry once the index has been rebuilt or articles were expired from it"""
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: List[float], version: Hashable) -> Optional[Dict[str, Any]]:
+        """Return the cached response for the most similar query above the threshold"""
+        self._sync_version(version)
+        self._entries.expire()
+
+        if self._matrix is not None and len(embedding) == self._matrix.shape[1]:
+            similarities = self._matrix[:self._rows_used] @ self._normalize(embedding)
+            similarities[~self._live[:self._rows_used]] = -np.inf
+            if len(similarities):
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.hits += 1
+                    CACHE_LOOKUPS.labels("semantic", "hit").inc()
+                    # Read through the cache so the entry counts as recently used
+                    _, response = self._entries[self._row_keys[best]]
+                    return response
+
+        self.record_miss()
+        return None
+
+    def record_miss(self):
+        """Count a miss, including lookups that could not be made at all"""
+        self.misses += 1
+        CACHE_LOOKUPS.labels("semantic", "miss").inc()
+
+    def store(self, embedding: List[float], version: Hashable, response: Dict[str, Any]):
+        """Cache a response under its query embedding"""
+        self._sync_version(version)
+        self._entries.expire()
+
+        vector = self._normalize(embedding)
+        if self._matrix is None or len(vector) != self._matrix.shape[1]:
+            self._entries.clear()
+            self._matrix = np.zeros((self._maxsize, len(vector)), dtype=np.float32)
+            self._free_rows.clear()
+            self._rows_used = 0
+
+        row = self._take_row()
+        key = next(self._keys)
+        self._matrix[row] = vector
+        self._live[row] = True
+        self._row_keys[row] = key
+        self._entries[key] = (row, response)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for tuning the similarity threshold"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": SEMANTIC_CACHE_ENABLED,
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+
+# Global cache instance
+semantic_cache = SemanticCache(
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+    maxsize=int(os.getenv("SEMANTIC_CACHE_SIZE", "1000")),
+    ttl=int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+)
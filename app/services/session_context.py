@@ -0,0 +1,34 @@
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+from services.mongodb import mongodb
+
+class SessionContext:
+    """Per-request view of a chat session. Loads the recent chat history once and shares 
+    it with every pipeline stage that needs it"""
+
+    def __init__(self, session_id: str, mongodb_instance=mongodb):
+        self.session_id = session_id
+        self._mongodb = mongodb_instance
+        self._shared: Dict[Hashable, asyncio.Future] = {}
+
+    async def shared(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Run factory() at most once per request for the given key - concurrent callers 
+        share the same result"""
+        if key not in self._shared:
+            self._shared[key] = asyncio.ensure_future(factory())
+        return await self._shared[key]
+
+    async def get_history(self, limit: int) -> List[dict]:
+        """Recent chats for the session (newest first) - concurrent callers share one fetch"""
+        history = await self.shared("history", lambda: self._mongodb.get_recent_history(self.session_id))
+        return history[:limit]
+
+    def get_history_sync(self, limit: int) -> List[dict]:
+        """Synchronous history read for retriever operations outside the event loop"""
+        return self._mongodb.get_chat_history_sync(self.session_id, limit)
+
+# Session of the chat currently being answered. Set once per request so the 
+# long-lived retrievers and QA chain can be shared across all sessions
+current_session: ContextVar[SessionContext] = ContextVar("current_session")
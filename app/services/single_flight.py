@@ -0,0 +1,56 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from services.metrics import COALESCED_REQUESTS
+
+COALESCING_ENABLED = os.getenv("COALESCING_ENABLED", "true").lower() == "true"
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key: the first caller starts the
+    computation and everyone arriving while it runs awaits the same result"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def _land(self, key: Hashable, flight: asyncio.Future):
+        # Only remove our own flight - a retry may already have taken the key
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Retrieve the exception even when every caller was cancelled and nobody
+        # awaits the flight, so asyncio doesn't log it as never retrieved
+        if not flight.cancelled():
+            flight.exception()
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Await factory() shared with every concurrent caller of the same key. The
+        computation runs in the context of the caller that started it"""
+        if not COALESCING_ENABLED:
+            return await factory()
+
+        flight = self._flights.get(key)
+        if flight is None:
+            self.started += 1
+            flight = asyncio.ensure_future(factory())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda done: self._land(key, done))
+        else:
+            self.coalesced += 1
+            COALESCED_REQUESTS.labels(self.name).inc()
+
+        # A caller going away (client disconnect) must not cancel the others' result
+        return await asyncio.shield(flight)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "coalesced": self.coalesced
+        }
+
+# Answers (enhanced query, retrieval, generation) and reference grading are coalesced separately
+response_flights = SingleFlight("response")
+reference_flights = SingleFlight("references")
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+
+import httpx
+
+# Configuration
+CHAT_API_URL = os.environ.get("CHAT_API_URL", "http://localhost:8000/chat")
+QUESTIONS = [
+    "How do I import data into Ardoq?",
+    "What is a workspace?",
+    "How do I create a new component type?",
+    "How can I share a presentation with my team?",
+]
+CONCURRENCY_LEVELS = [1, 4, 16, 64]
+REQUESTS_PER_SESSION = 2
+REQUEST_TIMEOUT = 120
+
+
+async def run_session(client, session_id, latencies, errors):
+    """Send a short sequence of questions for a single chat session."""
+    for i in range(REQUESTS_PER_SESSION):
+        question = QUESTIONS[(hash(session_id) + i) % len(QUESTIONS)]
+        start = time.perf_counter()
+        try:
+            response = await client.post(CHAT_API_URL, json={
+                "question": question,
+                "session_id": session_id
+            })
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except httpx.HTTPError as e:
+            errors.append(e)
+
+
+async def run_level(concurrency):
+    """Run `concurrency` sessions in parallel and return throughput stats."""
+    latencies = []
+    errors = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            run_session(client, f"loadtest-{uuid.uuid4()}", latencies, errors)
+            for _ in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "completed": len(latencies),
+        "errors": len(errors),
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "max": max(latencies) if latencies else 0.0,
+    }
+
+
+async def main(levels):
+    print(f"🚀 Load testing {CHAT_API_URL} at concurrency levels {levels}...")
+    results = []
+    for concurrency in levels:
+        result = await run_level(concurrency)
+        results.append(result)
+        print(f"📊 {concurrency:>4} sessions: {result['completed']} ok, "
+              f"{result['errors']} errors, {result['throughput']:.2f} req/s, "
+              f"p50 {result['p50']:.2f}s, max {result['max']:.2f}s")
+
+    # Throughput should grow with concurrency if the worker is not blocked
+    baseline = results[0]["throughput"]
+    if baseline:
+        for result in results[1:]:
+            print(f"📈 x{result['throughput'] / baseline:.1f} throughput at "
+                  f"{result['concurrency']} concurrent sessions")
+
+    print("✅ Load test completed!")
+
+
+if __name__ == "__main__":
+    levels = CONCURRENCY_LEVELS
+    if len(sys.argv) > 1:
+        try:
+            levels = [int(level) for level in sys.argv[1:]]
+        except ValueError:
+            print(f"⚠️ Invalid concurrency levels. Using default: {levels}")
+    asyncio.run(main(levels))
@@ -0,0 +1,382 @@
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from typing import Optional
+
+import numpy as np
+
+# Configuration
+CHUNKS = int(os.environ.get("BENCH_CHUNKS", "5000"))
+DIMENSIONS = int(os.environ.get("BENCH_DIMENSIONS", "1536"))
+VOCABULARY = int(os.environ.get("BENCH_VOCABULARY", "20000"))
+WORDS_PER_CHUNK = 150
+ARTICLES = max(1, CHUNKS // 5)
+ITERATIONS = int(os.environ.get("BENCH_ITERATIONS", "100"))
+TURNS_PER_SESSION = int(os.environ.get("BENCH_TURNS", "3"))
+ALLOCATION_TURNS = int(os.environ.get("BENCH_ALLOCATION_TURNS", "20"))
+CONCURRENCY_LEVELS = [1, 4, 16, 64]
+SEED = int(os.environ.get("BENCH_SEED", "0"))
+
+# Simulated latency (seconds) of every external call
+LLM_LATENCY = float(os.environ.get("BENCH_LLM_LATENCY", "0.05"))
+EMBEDDING_LATENCY = float(os.environ.get("BENCH_EMBEDDING_LATENCY", "0.01"))
+MONGO_LATENCY = float(os.environ.get("BENCH_MONGO_LATENCY", "0.001"))
+ANSWER_WORDS = 120
+ADD_BATCH_SIZE = 1000
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Everything runs against a throwaway index directory and in-memory stand-ins for
+# OpenAI and Mongo - no network needed
+work_dir = tempfile.mkdtemp(prefix="pipeline-bench-")
+os.environ.update({
+    "TOP_DIR": work_dir,
+    "CHROMA_DIR": "chroma",
+    "ARTICLES_DIR": "articles",
+    "VECTOR_BACKEND": os.environ.get("BENCH_VECTOR_BACKEND", "chroma"),
+})
+os.environ.pop("EMBEDDING_CACHE_DIR", None)
+# Measure the full pipeline rather than cached answers unless asked otherwise
+os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+# Keep chromadb from sending telemetry
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+sys.path.insert(0, os.path.join(ROOT_DIR, "scripts"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "app"))
+
+import chromadb
+import create_embeddings
+from bson import ObjectId
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+import api.chat
+from services import chatbot
+from services.articles import articles_service
+from services.chroma import chroma_service
+from services.embedding_cache import create_cached_embeddings
+from services.llm import ANSWER_TAG, llm_gateway
+from services.metrics import LLMMetricsHandler
+from services.mongodb import mongodb
+from services.session_context import SessionContext, current_session
+
+WORDS = [f"term{i}" for i in range(VOCABULARY)]
+
+
+def stable_seed(text):
+    """Seed derived from text - unlike hash(), the same in every run."""
+    return zlib.crc32(text.encode("utf-8")) ^ SEED
+
+
+def pick_words(rng, count):
+    """Words drawn with a Zipf-like skew, like real documentation."""
+    ranks = np.minimum(rng.zipf(1.3, count), VOCABULARY) - 1
+    return " ".join(WORDS[rank] for rank in ranks)
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic unit vectors per text, returned after a simulated API round trip."""
+
+    def _vector(self, text):
+        vector = np.random.default_rng(stable_seed(text)).standard_normal(DIMENSIONS)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(EMBEDDING_LATENCY)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(EMBEDDING_LATENCY)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model answering after a simulated delay. `mode` picks the kind of reply:
+    "enhance" (a short search query), "relevance" (YES/NO) or "answer" (a paragraph)."""
+
+    mode: str
+    latency: float
+
+    @property
+    def _llm_type(self):
+        return "benchmark-fake"
+
+    def _reply(self, messages):
+        rng = np.random.default_rng(stable_seed(messages[-1].content))
+        if self.mode == "relevance":
+            return "YES" if rng.random() < 0.5 else "NO"
+        if self.mode == "enhance":
+            return pick_words(rng, 8)
+        return pick_words(rng, ANSWER_WORDS)
+
+    def _result(self, messages):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(
+            content=self._reply(messages)))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        async def call():
+            await asyncio.sleep(self.latency)
+            return self._result(messages)
+        # Admitted like the real models, so gateway limits show up in the numbers
+        return await llm_gateway.call("answer" if self.mode == "answer" else "utility", call)
+
+
+def matches(document, query):
+    """The subset of Mongo query syntax used by the chat and article services."""
+    for field, condition in query.items():
+        if isinstance(condition, dict):
+            if "$in" in condition and document.get(field) not in condition["$in"]:
+                return False
+        elif document.get(field) != condition:
+            return False
+    return True
+
+
+class InMemoryCursor:
+    """Motor-like cursor over an in-memory collection."""
+
+    def __init__(self, documents, projection):
+        self._documents = documents
+        self._projection = projection
+        self._limit = None
+
+    def sort(self, keys):
+        for field, direction in reversed(keys):
+            self._documents.sort(key=lambda document: document[field], reverse=direction < 0)
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def _project(self, document):
+        if not self._projection:
+            return dict(document)
+        fields = {field for field, include in self._projection.items() if include}
+        projected = {field: value for field, value in document.items() if field in fields}
+        if self._projection.get("_id", 1):
+            projected["_id"] = document["_id"]
+        return projected
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(MONGO_LATENCY)
+        return [self._project(document) for document in self._documents[:self._limit]]
+
+    async def __aiter__(self):
+        for document in await self.to_list():
+            yield document
+
+
+class InMemoryCollection:
+    """Just enough of a Motor collection for the chat pipeline."""
+
+    def __init__(self, documents=()):
+        self._documents = list(documents)
+
+    def find(self, query, projection=None):
+        return InMemoryCursor([document for document in self._documents
+                               if matches(document, query)], projection)
+
+    async def insert_one(self, document):
+        await asyncio.sleep(MONGO_LATENCY)
+        document.setdefault("_id", ObjectId())
+        self._documents.append(document)
+
+
+def build_corpus(rng):
+    """Publish a generation of synthetic chunks, built the way create_embeddings.py does."""
+    generation = "bench"
+    generation_dir = os.path.join(work_dir, "chroma", create_embeddings.GENERATIONS_DIR,
+                                  generation)
+    collection = chromadb.PersistentClient(path=generation_dir).get_or_create_collection(
+        create_embeddings.COLLECTION_NAME, embedding_function=None)
+
+    for start in range(0, CHUNKS, ADD_BATCH_SIZE):
+        end = min(start + ADD_BATCH_SIZE, CHUNKS)
+        vectors = rng.standard_normal((end - start, DIMENSIONS)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.add(
+            ids=[f"chunk-{i}" for i in range(start, end)],
+            embeddings=vectors,
+            documents=[pick_words(rng, WORDS_PER_CHUNK) for _ in range(start, end)],
+            metadatas=[{"source": f"article-{i % ARTICLES}"} for i in range(start, end)]
+        )
+
+    create_embeddings.build_local_indexes(collection, generation_dir)
+    with open(os.path.join(work_dir, "chroma", create_embeddings.CURRENT_GENERATION_FILE),
+              "w") as f:
+        f.write(generation)
+
+
+def install_fakes():
+    """Point the pipeline's long-lived clients at the offline stand-ins."""
+    chroma_service._embeddings = create_cached_embeddings(FakeEmbeddings())
+
+    utility_callbacks = [LLMMetricsHandler("utility")]
+    chatbot.chroma_retriever.llm = FakeChatModel(
+        mode="enhance", latency=LLM_LATENCY, callbacks=utility_callbacks)
+    api.chat.relevance_llm = FakeChatModel(
+        mode="relevance", latency=LLM_LATENCY, callbacks=utility_callbacks)
+    chatbot.qa_chain.combine_documents_chain.llm_chain.llm = FakeChatModel(
+        mode="answer", latency=LLM_LATENCY, tags=[ANSWER_TAG],
+        callbacks=[LLMMetricsHandler("answer")])
+
+    mongodb.chats = InMemoryCollection()
+    articles_service.articles = InMemoryCollection(
+        {"_id": ObjectId(), "id": f"article-{i}", "title": f"Article {i}",
+         "url": f"https://help.example.com/articles/{i}"}
+        for i in range(ARTICLES)
+    )
+
+
+def percentiles(latencies):
+    """p50/p95/p99 in milliseconds."""
+    if len(latencies) < 2:
+        latencies = latencies * 2
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return cuts[49] * 1e3, cuts[94] * 1e3, cuts[98] * 1e3
+
+
+def report(name, latencies, elapsed: Optional[float] = None):
+    p50, p95, p99 = percentiles(latencies)
+    line = f"📊 {name:<22} p50 {p50:9.2f}ms   p95 {p95:9.2f}ms   p99 {p99:9.2f}ms"
+    if elapsed:
+        line += f"   {len(latencies) / elapsed:8.1f}/sec"
+    print(line)
+
+
+async def chat_turn(question, session_id):
+    """One /chat request: answer, references, history write."""
+    response = await chatbot.generate_response(question, session_id)
+    await api.chat.resolve_references(response, question)
+    await mongodb.store_chat(question, response["answer"], session_id)
+
+
+async def timed_call(latencies, factory):
+    start = time.perf_counter()
+    result = await factory()
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+async def in_session(session_id, factory):
+    """Run factory() the way a request does, inside a fresh session context."""
+    token = current_session.set(SessionContext(session_id))
+    try:
+        return await factory()
+    finally:
+        current_session.reset(token)
+
+
+async def benchmark_stages(rng):
+    """Latency of each stage in isolation, one request at a time."""
+    print(f"⏱️ Stage latency over {ITERATIONS} iterations...")
+    retrievers = {
+        "chroma retriever": chatbot.chroma_retriever,
+        "ensemble retriever": chatbot.qa_chain.retriever,
+    }
+    for name, retriever in retrievers.items():
+        latencies = []
+        for i in range(ITERATIONS):
+            question = pick_words(rng, 10)
+            await in_session(f"stage-{name}-{i}", lambda: timed_call(
+                latencies, lambda: retriever.ainvoke(question)))
+        report(name, latencies)
+
+    generate, references = [], []
+    for i in range(ITERATIONS):
+        question = pick_words(rng, 10)
+        # The second half revisits the sessions, so those questions have history to enhance with
+        session_id = f"stage-generate-{i % (ITERATIONS // 2 or 1)}"
+        response = await timed_call(
+            generate, lambda: chatbot.generate_response(question, session_id))
+        await timed_call(references, lambda: api.chat.format_references(
+            response["source_docs"], question))
+        await mongodb.store_chat(question, response["answer"], session_id)
+    report("generate_response", generate)
+    report("format_references", references)
+
+
+async def benchmark_concurrency(rng, levels):
+    """Throughput and turn latency with N sessions chatting at once."""
+    for concurrency in levels:
+        latencies = []
+        questions = [[pick_words(rng, 10) for _ in range(TURNS_PER_SESSION)]
+                     for _ in range(concurrency)]
+
+        async def run_session(session):
+            for question in questions[session]:
+                await timed_call(latencies, lambda: chat_turn(
+                    question, f"concurrency-{concurrency}-{session}"))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run_session(session) for session in range(concurrency)))
+        report(f"{concurrency} sessions", latencies, time.perf_counter() - start)
+
+
+async def benchmark_allocations(rng):
+    """Peak traced memory and memory retained per turn, with the top retaining lines."""
+    questions = [pick_words(rng, 10) for _ in range(ALLOCATION_TURNS)]
+    await chat_turn(questions[0], "allocations")  # warm up lazy state
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for question in questions:
+        await chat_turn(question, "allocations")
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    growth = after.compare_to(before, "lineno")
+    retained = sum(stat.size_diff for stat in growth)
+    print(f"🧠 Peak traced memory {peak / 1024:.0f} KiB, "
+          f"{retained / len(questions) / 1024:.1f} KiB retained per turn")
+    for stat in growth[:5]:
+        print(f"   {stat}")
+
+
+async def main(levels):
+    rng = np.random.default_rng(SEED)
+    print(f"🚀 Building a synthetic index of {CHUNKS} chunks x {DIMENSIONS} dimensions "
+          f"in {work_dir}...")
+    build_corpus(rng)
+    install_fakes()
+    print(f"🔧 Backend {os.environ['VECTOR_BACKEND']}, simulated latency: LLM "
+          f"{LLM_LATENCY * 1e3:.0f}ms, embedding {EMBEDDING_LATENCY * 1e3:.0f}ms, "
+          f"Mongo {MONGO_LATENCY * 1e3:.1f}ms")
+
+    await benchmark_stages(rng)
+    await benchmark_concurrency(rng, levels)
+    await benchmark_allocations(rng)
+    print("✅ Benchmark completed!")
+
+
+if __name__ == "__main__":
+    levels = CONCURRENCY_LEVELS
+    if len(sys.argv) > 1:
+        try:
+            levels = [int(level) for level in sys.argv[1:]]
+        except ValueError:
+            print(f"⚠️ Invalid concurrency levels. Using default: {levels}")
+    try:
+        asyncio.run(main(levels))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+from pymongo import MongoClient
+
+# Configuration
+MONGODB_URI = os.environ.get("MONGODB_URI", "mongodb://localhost:27017")
+# Servers to replay against as "label=url" pairs, e.g. one per uvicorn worker count:
+# "1=http://localhost:8001,4=http://localhost:8004"
+REPLAY_TARGETS = os.environ.get("REPLAY_TARGETS", "server=http://localhost:8000")
+REPLAY_SESSIONS = int(os.environ.get("REPLAY_SESSIONS", "100"))
+# Idle gaps longer than this (user walked away) are shortened to it before the speed-up
+REPLAY_MAX_THINK_SECONDS = float(os.environ.get("REPLAY_MAX_THINK_SECONDS", "120"))
+SPEEDUP_LEVELS = [10, 30, 100, 300]
+REQUEST_TIMEOUT = 120
+HISTORY_LIMIT = 10
+# A level is saturated when its /chat p95 grows this many times past the lightest level's...
+SATURATION_LATENCY_FACTOR = 2.0
+# ...or when it fails more requests than this
+SATURATION_ERROR_RATE = 0.01
+# Replayed sessions get fresh ids with this prefix and are never replayed themselves
+REPLAY_SESSION_PREFIX = "replay-"
+
+
+def load_sessions():
+    """Questions of the most recently active sessions, in order, with the offset (seconds)
+    of each from the first chat in the sample."""
+    chats = MongoClient(MONGODB_URI).chatbot.chats
+    recent = chats.aggregate([
+        {"$match": {"session_id": {"$not": {"$regex": f"^{REPLAY_SESSION_PREFIX}"}}}},
+        {"$group": {"_id": "$session_id", "last": {"$max": "$timestamp"}}},
+        {"$sort": {"last": -1}},
+        {"$limit": REPLAY_SESSIONS}
+    ])
+    session_ids = [session["_id"] for session in recent]
+
+    sessions = defaultdict(list)
+    cursor = chats.find({"session_id": {"$in": session_ids}},
+                        {"_id": 0, "session_id": 1, "question": 1, "timestamp": 1})
+    for chat in cursor.sort([("session_id", 1), ("timestamp", 1)]):
+        sessions[chat["session_id"]].append((chat["timestamp"], chat["question"]))
+    if not sessions:
+        return []
+
+    start = min(history[0][0] for history in sessions.values())
+    replay = []
+    for history in sessions.values():
+        # Session start keeps its real offset; gaps inside it are think times (plus the
+        # original answer time, as chats are stored once answered)
+        offset = (history[0][0] - start).total_seconds()
+        turns = []
+        previous = history[0][0]
+        for timestamp, question in history:
+            think = min((timestamp - previous).total_seconds(), REPLAY_MAX_THINK_SECONDS)
+            turns.append((think, question))
+            previous = timestamp
+        replay.append((offset, turns))
+
+    # Long quiet periods between sessions are shortened like think times
+    replay.sort(key=lambda session: session[0])
+    compressed, previous_offset, shift = [], 0.0, 0.0
+    for offset, turns in replay:
+        shift += max(0.0, offset - previous_offset - REPLAY_MAX_THINK_SECONDS)
+        previous_offset = offset
+        compressed.append((offset - shift, turns))
+    return compressed
+
+
+def percentiles(latencies):
+    """p50/p95/p99 in seconds."""
+    if len(latencies) < 2:
+        latencies = latencies * 2
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+async def timed_request(client, results, endpoint, method, url, **kwargs):
+    """Send a request and record its latency (or failure) under the endpoint name."""
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        response.raise_for_status()
+        results[endpoint]["latencies"].append(time.perf_counter() - start)
+    except httpx.HTTPError:
+        results[endpoint]["errors"] += 1
+
+
+async def replay_session(client, base_url, offset, turns, speedup, results):
+    """Replay one session in order under a fresh session id, then read its history and
+    delete it as a client closing the chat would."""
+    session_id = f"{REPLAY_SESSION_PREFIX}{uuid.uuid4()}"
+    await asyncio.sleep(offset / speedup)
+    for think, question in turns:
+        await asyncio.sleep(think / speedup)
+        await timed_request(client, results, "/chat", "POST", f"{base_url}/chat",
+                            json={"question": question, "session_id": session_id})
+
+    await timed_request(client, results, "/chat/history", "GET", f"{base_url}/chat/history",
+                        params={"session_id": session_id, "limit": HISTORY_LIMIT})
+    await timed_request(client, results, "/chat/session/{id}", "DELETE",
+                        f"{base_url}/chat/session/{session_id}")
+
+
+async def run_level(base_url, sessions, speedup):
+    """Replay every session at `speedup` and return per-endpoint results plus rates."""
+    results = defaultdict(lambda: {"latencies": [], "errors": 0})
+    requests = sum(len(turns) + 2 for _, turns in sessions)
+
+    limits = httpx.Limits(max_connections=len(sessions))
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            replay_session(client, base_url, offset, turns, speedup, results)
+            for offset, turns in sessions
+        ))
+        elapsed = time.perf_counter() - start
+
+    errors = sum(result["errors"] for result in results.values())
+    chat_latencies = results["/chat"]["latencies"]
+    return {
+        "speedup": speedup,
+        "results": results,
+        "throughput": (requests - errors) / elapsed if elapsed else 0.0,
+        "error_rate": errors / requests,
+        "chat_p95": percentiles(chat_latencies)[1] if chat_latencies else float("inf"),
+    }
+
+
+def print_level(level):
+    print(f"📊 x{level['speedup']:<5} {level['throughput']:8.2f} req/s   "
+          f"errors {level['error_rate']:.1%}")
+    for endpoint, result in sorted(level["results"].items()):
+        latencies = result["latencies"]
+        if latencies:
+            p50, p95, p99 = percentiles(latencies)
+            print(f"   {endpoint:<20} {len(latencies):>6} ok {result['errors']:>5} errors   "
+                  f"p50 {p50:7.2f}s   p95 {p95:7.2f}s   p99 {p99:7.2f}s")
+        else:
+            print(f"   {endpoint:<20} {0:>6} ok {result['errors']:>5} errors")
+
+
+def is_saturated(level, baseline):
+    """Think times start when an answer arrives, so a server that can't keep up shows
+    as queueing delay on /chat rather than as a lower request rate."""
+    return (level["chat_p95"] > SATURATION_LATENCY_FACTOR * baseline["chat_p95"]
+            or level["error_rate"] > SATURATION_ERROR_RATE)
+
+
+async def main(speedups):
+    sessions = load_sessions()
+    if not sessions:
+        print("❌ No chat sessions to replay")
+        return
+    chats = sum(len(turns) for _, turns in sessions)
+    print(f"🚀 Replaying {len(sessions)} sessions ({chats} questions) at speed-ups {speedups}...")
+
+    targets = [target.split("=", 1) for target in REPLAY_TARGETS.split(",")]
+    summary = []
+    for label, base_url in targets:
+        print(f"🎯 {label}: {base_url}")
+        sustained = None
+        saturated_at = None
+        baseline = None
+        for speedup in speedups:
+            level = await run_level(base_url.rstrip("/"), sessions, speedup)
+            print_level(level)
+            baseline = baseline or level
+            if is_saturated(level, baseline):
+                saturated_at = speedup
+                # Heavier levels only pile more load on a server that can't keep up
+                break
+            sustained = level
+        summary.append((label, sustained, saturated_at))
+
+    for label, sustained, saturated_at in summary:
+        kept_up = (f"sustained {sustained['throughput']:.2f} req/s at x{sustained['speedup']}"
+                   if sustained else "saturated at the lowest level")
+        saturation = f"saturates at x{saturated_at}" if saturated_at else "never saturated"
+        print(f"📈 {label}: {kept_up}, {saturation}")
+
+    print("✅ Replay completed!")
+
+
+if __name__ == "__main__":
+    speedups = SPEEDUP_LEVELS
+    if len(sys.argv) > 1:
+        try:
+            speedups = [float(speedup) for speedup in sys.argv[1:]]
+        except ValueError:
+            print(f"⚠️ Invalid speed-ups. Using default: {speedups}")
+    asyncio.run(main(speedups))
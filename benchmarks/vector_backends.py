@@ -0,0 +1,125 @@
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Configuration
+CHUNKS = int(os.environ.get("BENCH_CHUNKS", "5000"))
+DIMENSIONS = int(os.environ.get("BENCH_DIMENSIONS", "1536"))
+QUERIES = int(os.environ.get("BENCH_QUERIES", "200"))
+K = 4
+ADD_BATCH_SIZE = 1000
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Everything runs against a throwaway index directory - no network, no OpenAI calls
+work_dir = tempfile.mkdtemp(prefix="vector-bench-")
+os.environ.update({
+    "TOP_DIR": work_dir,
+    "CHROMA_DIR": "chroma",
+    "ARTICLES_DIR": "articles",
+    "VECTOR_BACKEND": "chroma",
+})
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+# Keep chromadb from sending telemetry
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+sys.path.insert(0, os.path.join(ROOT_DIR, "scripts"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "app"))
+
+import chromadb
+import create_embeddings
+from services.chroma import chroma_service
+from services.local_index import ChunkTable, VectorIndex
+
+
+def build_corpus(rng):
+    """Publish a generation of random unit vectors, built the way create_embeddings.py does."""
+    generation = "bench"
+    generation_dir = os.path.join(work_dir, "chroma", create_embeddings.GENERATIONS_DIR,
+                                  generation)
+    collection = chromadb.PersistentClient(path=generation_dir).get_or_create_collection(
+        create_embeddings.COLLECTION_NAME, embedding_function=None)
+
+    vectors = rng.standard_normal((CHUNKS, DIMENSIONS)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    for start in range(0, CHUNKS, ADD_BATCH_SIZE):
+        end = min(start + ADD_BATCH_SIZE, CHUNKS)
+        collection.add(
+            ids=[f"chunk-{i}" for i in range(start, end)],
+            embeddings=vectors[start:end],
+            documents=[f"chunk {i}" for i in range(start, end)],
+            metadatas=[{"source": f"article-{i // 5}"} for i in range(start, end)]
+        )
+
+    create_embeddings.build_local_indexes(collection, generation_dir)
+    with open(os.path.join(work_dir, "chroma", create_embeddings.CURRENT_GENERATION_FILE),
+              "w") as f:
+        f.write(generation)
+    return generation_dir, vectors
+
+
+def run(name, search, queries):
+    """Time every query and return latencies plus the documents found."""
+    search(queries[0])  # warm up caches and lazy connections
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        found = search(query)
+        latencies.append(time.perf_counter() - start)
+        results.append([doc.page_content for doc, _ in found])
+
+    latencies.sort()
+    print(f"📊 {name:<16} p50 {statistics.median(latencies) * 1e3:8.3f}ms   "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1e3:8.3f}ms   "
+          f"{len(latencies) / sum(latencies):10.0f} queries/sec")
+    return results
+
+
+def recall(results, exact):
+    """Share of the exact top-k found by a backend."""
+    hits = sum(len(set(found) & set(truth)) for found, truth in zip(results, exact))
+    return hits / sum(len(truth) for truth in exact)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f"🚀 Building a synthetic index of {CHUNKS} chunks x {DIMENSIONS} dimensions "
+          f"in {work_dir}...")
+    generation_dir, vectors = build_corpus(rng)
+
+    # Queries near corpus vectors, like real questions near their answers
+    targets = rng.integers(0, CHUNKS, QUERIES)
+    queries = vectors[targets] + 0.05 * rng.standard_normal((QUERIES, DIMENSIONS)).astype(np.float32)
+    queries = [query.tolist() for query in queries]
+
+    chunks = ChunkTable(generation_dir)
+    vector_dir = os.path.join(generation_dir, create_embeddings.VECTOR_INDEX_DIR)
+    backends = {
+        "chroma": lambda query: chroma_service.similarity_search_by_vector_with_score(query, K),
+        "numpy float32": VectorIndex(vector_dir, chunks, "float32").search,
+        "numpy int8": VectorIndex(vector_dir, chunks, "int8").search,
+    }
+
+    results = {}
+    for name, search in backends.items():
+        if name.startswith("numpy"):
+            search = (lambda index_search: lambda query: index_search(query, K))(search)
+        results[name] = run(name, search, queries)
+
+    # The float32 matrix search is exact - measure the others against it
+    for name in ("chroma", "numpy int8"):
+        print(f"🎯 {name} recall@{K} vs exact: {recall(results[name], results['numpy float32']):.3f}")
+
+    print("✅ Benchmark completed!")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -1,10 +1,19 @@
+import hashlib
+import json
 import os
+import re
 import shutil
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+import chromadb
+import numpy as np
 from dotenv import load_dotenv
-from langchain_community.document_loaders import TextLoader, DirectoryLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
 from langchain_openai import OpenAIEmbeddings
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
 
 # Load .env
 load_dotenv()
@@ -14,29 +23,425 @@ chroma_dir = os.environ.get("CHROMA_DIR")
 articles_dir_path = os.path.join(top_dir, articles_dir)
 chroma_dir_path = os.path.join(top_dir, chroma_dir)
 
-# Load all text files
-loader = DirectoryLoader(articles_dir_path, glob="*", loader_cls=TextLoader)
-docs = loader.load()
-# Still need to clean metadata
-for doc in docs:
-    doc.metadata['source'] = os.path.basename(doc.metadata['source'])
+# Versioned index layout: every build is a full Chroma directory under
+# generations/<id>/ and the CURRENT file names the one the backend serves
+CURRENT_GENERATION_FILE = "CURRENT"
+GENERATIONS_DIR = "generations"
+# Generations kept on disk (current + previous) so in-flight reads can finish
+KEEP_GENERATIONS = 2
+# Index bookkeeping file stored inside each generation
+MANIFEST_FILE = "index_manifest.json"
+# Collection name LangChain's Chroma wrapper reads from in the backend
+COLLECTION_NAME = "langchain"
+# In-process indexes stored inside each generation next to the Chroma data: a
+# chunk table, a BM25 index and an embedding matrix, all in the same row order
+CHUNKS_FILE = "chunks.json"
+LEXICAL_INDEX_DIR = "bm25"
+VECTOR_INDEX_DIR = "vectors"
+# Written by the backend when articles expire; a rebuild drops their chunks anyway
+DELETED_SOURCES_FILE = "deleted_sources.json"
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Keeps product terms, versions and error codes like "ERR-404" or "v2.1" whole.
+# Written into the index so the backend tokenizes queries the same way
+TOKEN_PATTERN = r"\w+(?:[-.]\w+)*"
+# Chunks read from Chroma per page while building the in-process indexes
+LOCAL_INDEX_READ_BATCH_SIZE = 1000
+
+# Pipeline tuning
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", "5"))
+EMBEDDING_RETRY_DELAY = float(os.environ.get("EMBEDDING_RETRY_DELAY", "1"))
+SPLIT_WORKERS = int(os.environ.get("SPLIT_WORKERS", str(os.cpu_count() or 1)))
 
-# Split into smaller chunks
 splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-chunks = splitter.split_documents(docs)
 
-# Create embeddings
-embedding = OpenAIEmbeddings()
+# Create embeddings - cached on disk by model name + text hash so unchanged chunks
+# are not re-embedded on the next run
+embedding_cache_dir = os.environ.get("EMBEDDING_CACHE_DIR",
+                                     os.path.join(top_dir, "embedding_cache"))
+underlying_embedding = OpenAIEmbeddings()
+embedding = CacheBackedEmbeddings.from_bytes_store(
+    underlying_embedding,
+    LocalFileStore(embedding_cache_dir),
+    namespace=underlying_embedding.model
+)
+
+
+def content_hash(text):
+    """Stable hash of a piece of text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def load_manifest(path):
+    """Load the article -> {hash, chunk_ids} manifest of an existing index."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def current_generation_path():
+    """Directory of the generation being served, or the legacy single-directory
+    index if no generation has been published yet."""
+    try:
+        with open(os.path.join(chroma_dir_path, CURRENT_GENERATION_FILE)) as f:
+            generation = f.read().strip()
+    except OSError:
+        generation = None
+    if generation:
+        return os.path.join(chroma_dir_path, GENERATIONS_DIR, generation)
+    if os.path.exists(os.path.join(chroma_dir_path, "chroma.sqlite3")):
+        return chroma_dir_path
+    return None
+
+
+def publish_generation(generation):
+    """Atomically point CURRENT at a new generation and prune old ones."""
+    marker_path = os.path.join(chroma_dir_path, CURRENT_GENERATION_FILE)
+    with open(marker_path + ".tmp", "w") as f:
+        f.write(generation)
+    os.replace(marker_path + ".tmp", marker_path)
+
+    # Generation ids sort chronologically; unfinished builds end in .tmp
+    generations_path = os.path.join(chroma_dir_path, GENERATIONS_DIR)
+    finished = sorted(name for name in os.listdir(generations_path)
+                      if not name.endswith(".tmp"))
+    stale = finished[:-KEEP_GENERATIONS] + [
+        name for name in os.listdir(generations_path)
+        if name.endswith(".tmp")]
+    for name in stale:
+        shutil.rmtree(os.path.join(generations_path, name), ignore_errors=True)
+        print(f"🗑️ Removed old index generation: {name}")
+
+
+def hash_articles():
+    """Hash every article file, keyed by file name (the article id). Files are
+    read one at a time so memory does not grow with the corpus."""
+    hashes = {}
+    for name in os.listdir(articles_dir_path):
+        path = os.path.join(articles_dir_path, name)
+        # Skip the scraper's temp folder and anything else that isn't an article
+        if not os.path.isfile(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            hashes[name] = content_hash(f.read())
+    return hashes
+
+
+def split_article(source):
+    """Read and split one article into (chunk id, text) pairs. Runs in a worker
+    process; chunk ids are derived from the chunk content."""
+    with open(os.path.join(articles_dir_path, source), encoding="utf-8") as f:
+        text = f.read()
+    chunks = {}
+    for chunk in splitter.split_text(text):
+        # Identical chunks within an article collapse into one vector
+        chunks[f"{source}:{content_hash(chunk)[:32]}"] = chunk
+    return source, list(chunks.items())
+
+
+def embed_batch(batch):
+    """Embed a batch of (id, text, source) chunks, retrying with exponential backoff."""
+    texts = [text for _, text, _ in batch]
+    for attempt in range(EMBEDDING_MAX_RETRIES):
+        try:
+            return batch, embedding.embed_documents(texts)
+        except Exception as e:
+            if attempt == EMBEDDING_MAX_RETRIES - 1:
+                raise
+            delay = EMBEDDING_RETRY_DELAY * (2 ** attempt)
+            print(f"⚠️ Embedding batch failed (attempt {attempt + 1}/"
+                  f"{EMBEDDING_MAX_RETRIES}): {e}. Retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+
+def bounded_map(executor, fn, items, max_pending):
+    """Like executor.map, but keeps at most max_pending items in flight so the
+    input is consumed lazily. Results are yielded in input order."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def batched(items, size):
+    """Group an iterable into lists of at most `size` items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def new_chunks(split_results, hashes, manifest, collection, stats):
+    """Yield chunks that are not in the index yet, deleting chunks that
+    disappeared from changed articles and updating the manifest as we go."""
+    for source, chunks in split_results:
+        previous_ids = set(manifest.get(source, {}).get("chunk_ids", []))
+        chunk_ids = [chunk_id for chunk_id, _ in chunks]
+
+        stale_ids = list(previous_ids.difference(chunk_ids))
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+            stats["deleted"] += len(stale_ids)
+
+        for chunk_id, text in chunks:
+            if chunk_id not in previous_ids:
+                yield chunk_id, text, source
+
+        manifest[source] = {
+            "hash": hashes[source],
+            "chunk_ids": chunk_ids
+        }
+
+
+def read_pages(collection):
+    """Yield the collection's chunks a page at a time, as (ids, sources, texts,
+    embeddings) lists in collection order."""
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas", "embeddings"],
+                              limit=LOCAL_INDEX_READ_BATCH_SIZE, offset=offset)
+        sources = [(metadata or {}).get("source") for metadata in page["metadatas"]]
+        yield page["ids"], sources, page["documents"], page["embeddings"]
+        if len(page["ids"]) < LOCAL_INDEX_READ_BATCH_SIZE:
+            return
+        offset += LOCAL_INDEX_READ_BATCH_SIZE
+
+
+def build_lexical_index(texts, index_dir):
+    """Build a BM25 index over the chunk texts. Postings are stored as CSR arrays
+    with the full BM25 weight precomputed per (term, chunk), so the backend
+    scores a query with one scatter-add per query term."""
+    tokenizer = re.compile(TOKEN_PATTERN)
+    vocab = {}
+    term_ids, chunk_ids, term_counts, lengths = [], [], [], []
+
+    for row, text in enumerate(texts):
+        counts = Counter(vocab.setdefault(token, len(vocab))
+                         for token in tokenizer.findall(text.lower()))
+        term_ids.extend(counts.keys())
+        chunk_ids.extend([row] * len(counts))
+        term_counts.extend(counts.values())
+        lengths.append(sum(counts.values()))
+
+    term_ids = np.asarray(term_ids, dtype=np.int32)
+    chunk_ids = np.asarray(chunk_ids, dtype=np.int32)
+    term_counts = np.asarray(term_counts, dtype=np.float32)
+    lengths = np.asarray(lengths, dtype=np.float32)
+
+    # Group postings by term
+    order = np.argsort(term_ids, kind="stable")
+    term_ids, chunk_ids, term_counts = term_ids[order], chunk_ids[order], term_counts[order]
+    document_frequency = np.bincount(term_ids, minlength=len(vocab))
+    offsets = np.concatenate([[0], np.cumsum(document_frequency)]).astype(np.int64)
+
+    total = len(lengths)
+    average_length = float(lengths.mean()) if total else 0.0
+    idf = np.log1p((total - document_frequency + 0.5) / (document_frequency + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[chunk_ids] / (average_length or 1))
+    weights = (idf[term_ids] * term_counts * (BM25_K1 + 1) /
+               (term_counts + norm)).astype(np.float32)
+
+    os.makedirs(index_dir)
+    np.save(os.path.join(index_dir, "offsets.npy"), offsets)
+    np.save(os.path.join(index_dir, "postings.npy"), chunk_ids)
+    np.save(os.path.join(index_dir, "weights.npy"), weights)
+    with open(os.path.join(index_dir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"token_pattern": TOKEN_PATTERN, "k1": BM25_K1, "b": BM25_B,
+                   "chunks": total, "terms": len(vocab),
+                   "average_length": average_length}, f)
+    return len(vocab)
+
+
+def open_vector_index(index_dir, count, dimensions):
+    """Preallocate the on-disk matrices of the vector index: unit-length float32
+    rows, an int8 copy and one scale per row. Rows are filled by write_vectors."""
+    os.makedirs(index_dir)
+
+    def allocate(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(index_dir, name), mode="w+",
+                                         dtype=dtype, shape=shape)
+
+    return (allocate("embeddings.npy", np.float32, (count, dimensions)),
+            allocate("embeddings_int8.npy", np.int8, (count, dimensions)),
+            allocate("scales.npy", np.float32, (count,)))
+
+
+def write_vectors(index, start, vectors):
+    """Normalize and quantize a page of embeddings into rows start.. of the
+    vector index."""
+    matrix, quantized, scales = index
+    page = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(page, axis=1, keepdims=True)
+    page /= np.where(norms == 0, 1, norms)
+
+    page_scales = np.abs(page).max(axis=1) / 127
+    page_scales[page_scales == 0] = 1
+    end = start + len(page)
+    matrix[start:end] = page
+    quantized[start:end] = np.round(page / page_scales[:, None])
+    scales[start:end] = page_scales
+
+
+def build_local_indexes(collection, generation_dir):
+    """Rebuild the in-process indexes of a generation from its Chroma collection,
+    streaming it a page at a time: embeddings go straight into memory-mapped
+    matrices and chunk columns into part files joined into the chunk table at
+    the end. Only the BM25 postings are held in memory. Returns (chunk count,
+    term count)."""
+    for name in (LEXICAL_INDEX_DIR, VECTOR_INDEX_DIR):
+        shutil.rmtree(os.path.join(generation_dir, name), ignore_errors=True)
+    vector_dir = os.path.join(generation_dir, VECTOR_INDEX_DIR)
+    count = collection.count()
+    columns = ("ids", "sources", "texts")
+    part_paths = {column: os.path.join(generation_dir, f"{CHUNKS_FILE}.{column}")
+                  for column in columns}
+    parts = {column: open(path, "w", encoding="utf-8")
+             for column, path in part_paths.items()}
+    index = None
+    rows = 0
+
+    def texts():
+        # Feeds the BM25 builder while writing everything else of each page to disk
+        nonlocal index, rows
+        for ids, sources, page_texts, vectors in read_pages(collection):
+            if not ids:
+                continue
+            if rows + len(ids) > count:
+                raise RuntimeError(f"Collection grew past {count} chunks while indexing")
+            for column, values in zip(columns, (ids, sources, page_texts)):
+                # Bare JSON array items, comma-separated across pages
+                parts[column].write(("," if rows else "") + json.dumps(values)[1:-1])
+            if index is None:
+                index = open_vector_index(vector_dir, count, len(vectors[0]))
+            write_vectors(index, rows, vectors)
+            rows += len(ids)
+            yield from page_texts
+
+    try:
+        term_count = build_lexical_index(texts(), os.path.join(generation_dir,
+                                                               LEXICAL_INDEX_DIR))
+        if rows != count:
+            raise RuntimeError(f"Read {rows} of {count} chunks while indexing")
+    finally:
+        for part in parts.values():
+            part.close()
+
+    if index is None:
+        os.makedirs(vector_dir)
+        np.save(os.path.join(vector_dir, "embeddings.npy"), np.zeros((0, 1), np.float32))
+        np.save(os.path.join(vector_dir, "embeddings_int8.npy"), np.zeros((0, 1), np.int8))
+        np.save(os.path.join(vector_dir, "scales.npy"), np.zeros(0, np.float32))
+    else:
+        for matrix in index:
+            matrix.flush()
+
+    with open(os.path.join(generation_dir, CHUNKS_FILE), "w", encoding="utf-8") as f:
+        for position, column in enumerate(columns):
+            f.write(("{" if position == 0 else "], ") + json.dumps(column) + ": [")
+            with open(part_paths[column], encoding="utf-8") as part:
+                shutil.copyfileobj(part, f)
+            os.remove(part_paths[column])
+        f.write("]}")
+    return rows, term_count
+
+
+def main():
+    start = time.perf_counter()
+
+    # Build the next generation from a copy of the live one so readers never
+    # see a half-updated index
+    generation = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    generation_dir = os.path.join(chroma_dir_path, GENERATIONS_DIR, generation)
+    temp_dir = generation_dir + ".tmp"
+    os.makedirs(os.path.dirname(temp_dir), exist_ok=True)
+    live_dir = current_generation_path()
+    if live_dir and not os.path.exists(os.path.join(live_dir, MANIFEST_FILE)):
+        # A legacy index has no record of which chunks belong to which article, so
+        # none of its vectors could ever be replaced - start from an empty collection
+        print(f"⚠️ No {MANIFEST_FILE} in {live_dir}, rebuilding the index from scratch")
+        live_dir = None
+    if live_dir:
+        shutil.copytree(live_dir, temp_dir, ignore=shutil.ignore_patterns(
+            GENERATIONS_DIR, CURRENT_GENERATION_FILE + "*", DELETED_SOURCES_FILE))
+
+    manifest = load_manifest(os.path.join(temp_dir, MANIFEST_FILE))
+    hashes = hash_articles()
+
+    removed = [source for source in manifest if source not in hashes]
+    changed = [source for source, digest in hashes.items()
+               if manifest.get(source, {}).get("hash") != digest]
+
+    if (not removed and not changed and
+            os.path.exists(os.path.join(temp_dir, VECTOR_INDEX_DIR))):
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        print("✅ Index is up to date, nothing to embed.")
+        return
+
+    print(f"🔍 {len(changed)} new or changed articles, {len(removed)} removed "
+          f"(of {len(hashes)} total)")
+
+    client = chromadb.PersistentClient(path=temp_dir)
+    collection = client.get_or_create_collection(COLLECTION_NAME, embedding_function=None)
+    stats = {"deleted": 0, "embedded": 0}
+
+    # Drop vectors of removed articles
+    for source in removed:
+        stale_ids = manifest.pop(source)["chunk_ids"]
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+            stats["deleted"] += len(stale_ids)
+
+    # Stream: split in worker processes -> batch -> embed concurrently -> upsert
+    with ProcessPoolExecutor(max_workers=SPLIT_WORKERS) as split_pool, \
+            ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as embed_pool:
+        split_results = bounded_map(split_pool, split_article, changed,
+                                    SPLIT_WORKERS * 2)
+        batches = batched(new_chunks(split_results, hashes, manifest, collection, stats),
+                          EMBEDDING_BATCH_SIZE)
+
+        for batch, vectors in bounded_map(embed_pool, embed_batch, batches,
+                                          EMBEDDING_CONCURRENCY):
+            collection.upsert(
+                ids=[chunk_id for chunk_id, _, _ in batch],
+                embeddings=vectors,
+                documents=[text for _, text, _ in batch],
+                metadatas=[{"source": source} for _, _, source in batch]
+            )
+            stats["embedded"] += len(batch)
+            elapsed = time.perf_counter() - start
+            print(f"📝 Embedded {stats['embedded']} chunks "
+                  f"({stats['embedded'] / elapsed:.1f} chunks/sec)")
+
+    print(f"🗑️ Deleted {stats['deleted']} stale chunks")
+
+    # Rebuilt from scratch - cheap next to embedding, and BM25 needs global statistics
+    chunk_count, term_count = build_local_indexes(collection, temp_dir)
+    print(f"🔤 Built in-process indexes: {chunk_count} chunks, {term_count} terms")
+
+    with open(os.path.join(temp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    # Publish the new generation - running backends switch to it on their next query
+    os.rename(temp_dir, generation_dir)
+    publish_generation(generation)
+    print(f"📦 Published index generation: {generation}")
 
-# Atomic rename - create in temp directory then move
-temp_dir = chroma_dir_path.rstrip('/') + ".tmp"
-vectordb = Chroma.from_documents(chunks, embedding, 
-                                persist_directory=temp_dir)
-vectordb.persist()
+    elapsed = time.perf_counter() - start
+    print(f"✅ Embeddings stored in Chroma: {stats['embedded']} chunks in "
+          f"{elapsed:.1f}s ({stats['embedded'] / elapsed:.1f} chunks/sec).")
 
-# Remove old data and atomically move new data
-if os.path.exists(chroma_dir_path):
-    shutil.rmtree(chroma_dir_path)
-os.rename(temp_dir, chroma_dir_path)
 
-print("✅ Embeddings stored in Chroma.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
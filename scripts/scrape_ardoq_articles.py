@@ -1,8 +1,12 @@
 import os
+import hashlib
 import json
+import queue
+import threading
 import time
+from contextlib import contextmanager
 from urllib.parse import urlparse, urljoin
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from dotenv import load_dotenv
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -16,6 +20,8 @@ import requests
 BASE_URL = "https://help.ardoq.com"
 START_URL = f"{BASE_URL}/en/"
 ARTICLES_API_URL = "http://backend:8000/articles"
+ARTICLES_BULK_API_URL = f"{ARTICLES_API_URL}/bulk"
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36")
 
 load_dotenv()
 top_dir = os.environ.get("TOP_DIR")
@@ -23,8 +29,26 @@ articles_dir = os.environ.get("ARTICLES_DIR")
 articles_dir_path = os.path.join(top_dir, articles_dir)
 temp_dir_path = os.path.join(articles_dir_path, "temp")
 
+# Crawl tuning
+CRAWL_WORKERS = int(os.environ.get("CRAWL_WORKERS", "8"))
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", "2"))
+# Minimum seconds between two requests to the same host
+CRAWL_DELAY = float(os.environ.get("CRAWL_DELAY", "0.25"))
+# Pages with less visible text than this over plain HTTP are treated as
+# JavaScript-rendered and fetched again with a browser
+MIN_TEXT_LENGTH = int(os.environ.get("MIN_TEXT_LENGTH", "500"))
+HTTP_TIMEOUT = 15
+# Crawl state persisted between runs: per-page validators, content hashes and
+# article ids, plus the frontier of an interrupted run
+CRAWL_STATE_PATH = os.environ.get("CRAWL_STATE_PATH",
+                                  os.path.join(top_dir, "crawl_state.json"))
+# Save the frontier every N processed pages so a killed run can resume
+CRAWL_STATE_SAVE_INTERVAL = 25
+# Pages posted to the articles service per bulk request
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "50"))
+
 visited = set()
-queue = {START_URL}
+queue_urls = {START_URL}
 os.makedirs(articles_dir_path, exist_ok=True)
 os.makedirs(temp_dir_path, exist_ok=True)
 
@@ -37,13 +61,13 @@ def create_webdriver():
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--window-size=1920,1080")
-    chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36")
+    chrome_options.add_argument(f"--user-agent={USER_AGENT}")
     chrome_options.add_argument("--disable-web-security")
     chrome_options.add_argument("--disable-features=VizDisplayCompositor")
-    
+
     # Use system chromium binary and driver
     chrome_options.binary_location = "/usr/bin/chromium"
-    
+
     try:
         driver = webdriver.Chrome(
             options=chrome_options,
@@ -56,31 +80,141 @@ def create_webdriver():
         return None
 
 
+class WebDriverPool:
+    """Bounded pool of long-lived WebDriver instances, created on first use."""
+
+    def __init__(self, size):
+        self._idle = queue.Queue()
+        self._slots = threading.Semaphore(size)
+        self._lock = threading.Lock()
+        self._drivers = []
+
+    @contextmanager
+    def driver(self):
+        """Borrow a driver; broken drivers are replaced on the next borrow."""
+        with self._slots:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = create_webdriver()
+                if driver:
+                    with self._lock:
+                        self._drivers.append(driver)
+
+            healthy = driver is not None
+            try:
+                yield driver
+            except WebDriverException:
+                healthy = False
+                raise
+            finally:
+                if healthy:
+                    self._idle.put(driver)
+                elif driver:
+                    self._discard(driver)
+
+    def _discard(self, driver):
+        with self._lock:
+            self._drivers.remove(driver)
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def close(self):
+        """Quit every driver in the pool."""
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+        for driver in drivers:
+            try:
+                driver.quit()
+            except WebDriverException:
+                pass
+
+
+class HostRateLimiter:
+    """Per-host politeness: spaces requests to the same host by `delay` seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.delay
+        if slot > now:
+            time.sleep(slot - now)
+
+
+driver_pool = WebDriverPool(BROWSER_POOL_SIZE)
+rate_limiter = HostRateLimiter(CRAWL_DELAY)
+_thread_local = threading.local()
+
+
+def get_http_session():
+    """One requests session per worker thread so connections are reused."""
+    if not hasattr(_thread_local, "session"):
+        session = requests.Session()
+        session.headers["User-Agent"] = USER_AGENT
+        _thread_local.session = session
+    return _thread_local.session
+
+
+def load_crawl_state():
+    """Load the persisted crawl state, or an empty one."""
+    try:
+        with open(CRAWL_STATE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"pages": {}, "frontier": [], "visited": []}
+
+
+def save_crawl_state(state):
+    """Atomically write the crawl state."""
+    temp_path = CRAWL_STATE_PATH + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(temp_path, CRAWL_STATE_PATH)
+
+
+def content_hash(text):
+    """Stable hash of a page's extracted text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def article_file_exists(page):
+    """Whether the article file of a previously crawled page is still on disk."""
+    article_id = page.get("article_id")
+    return bool(article_id) and os.path.exists(
+        os.path.join(articles_dir_path, article_id))
+
+
 def normalize_url(url):
     """Remove URL fragment to avoid duplicate processing of same page."""
     parsed = urlparse(url)
     return parsed._replace(fragment='').geturl()
 
 
-def post_to_articles_service(title, url, content):
-    """Posts article data to the MongoDB service and returns the UUID."""
+def post_articles_batch(articles):
+    """Posts a batch of articles to the articles service as NDJSON and returns
+    their UUIDs in order, or None if the request failed."""
     try:
-        # API expects title and url as query parameters, content in body
-        params = {
-            "title": title,
-            "url": url
-        }
-        payload = {
-            "content": content
-        }
-        response = requests.post(ARTICLES_API_URL, params=params, 
-                                json=payload, 
-                                headers={"Content-Type": "application/json"})
+        payload = "\n".join(json.dumps({
+            "title": article["title"],
+            "url": article["url"],
+            "content": article["content"]
+        }) for article in articles)
+        response = get_http_session().post(
+            ARTICLES_BULK_API_URL, data=payload.encode("utf-8"),
+            headers={"Content-Type": "application/x-ndjson"})
         response.raise_for_status()
-        result = response.json()
-        uuid = result.get("id")  # API returns "id" field
-        print(f"✅ Posted to articles service, UUID: {uuid}")
-        return uuid
+        uuids = response.json()["ids"]
+        print(f"✅ Posted {len(uuids)} articles to articles service")
+        return uuids
     except requests.exceptions.RequestException as e:
         print(f"⚠️ Error posting to articles service: {e}")
         return None
@@ -89,121 +223,258 @@ def post_to_articles_service(title, url, content):
         return None
 
 
-def download_and_process_page(url):
-    """Downloads a page using Selenium, saves its text content, posts to 
-    articles service, and extracts new links from <a> tags."""
-    normalized_url = normalize_url(url)
-    if normalized_url in visited:
-        return set()
+def ingest_pending(pending):
+    """Post the pending pages in one bulk request, then move their saved
+    content to its article file and record the validators that describe it.
+    Pages that fail stay in temp and are stored again on the next run."""
+    if not pending:
+        return
+    uuids = post_articles_batch(pending)
+    for i, article in enumerate(pending):
+        if uuids is None or uuids[i] is None:
+            if article["temp_path"]:
+                print(f"⚠️ Failed to post to articles service, file left in "
+                      f"temp: {article['temp_path']}")
+            continue
+        record = article["record"]
+        if article["temp_path"]:
+            # Move file from temp to main directory with UUID name
+            uuid_filepath = os.path.join(articles_dir_path, f"{uuids[i]}")
+            os.replace(article["temp_path"], uuid_filepath)
+            print(f"📝 Moved file to main directory: {uuid_filepath}")
+        record["article_id"] = uuids[i]
+        record.update(article["validators"])
+    pending.clear()
 
-    visited.add(normalized_url)
-    print(f"🔍 Processing URL: {url}")
-    
-    driver = create_webdriver()
-    if not driver:
-        print(f"⚠️ Failed to create WebDriver for {url}")
-        return set()
-    
-    try:
-        # Load the page
+
+def fetch_with_http(url, page):
+    """Fetch a page over plain HTTP, revalidating against the previous crawl.
+    Returns (status, html, response headers). html is None for a 304 or when
+    the page looks JavaScript-rendered and needs a browser."""
+    headers = {}
+    # Only revalidate if we still have the content the validators refer to
+    if article_file_exists(page):
+        if page.get("etag"):
+            headers["If-None-Match"] = page["etag"]
+        if page.get("last_modified"):
+            headers["If-Modified-Since"] = page["last_modified"]
+
+    rate_limiter.wait(url)
+    response = get_http_session().get(url, headers=headers,
+                                      timeout=HTTP_TIMEOUT)
+    if response.status_code == 304:
+        return 304, None, response.headers
+    response.raise_for_status()
+    if "html" not in response.headers.get("Content-Type", "html"):
+        return response.status_code, None, response.headers
+    soup = BeautifulSoup(response.text, "html.parser")
+    if len(soup.get_text(" ", strip=True)) < MIN_TEXT_LENGTH:
+        return response.status_code, None, response.headers
+    return response.status_code, response.text, response.headers
+
+
+def fetch_with_browser(url):
+    """Fetch a page with a pooled WebDriver, waiting for JavaScript to finish."""
+    with driver_pool.driver() as driver:
+        if not driver:
+            print(f"⚠️ Failed to create WebDriver for {url}")
+            return None
+
+        rate_limiter.wait(url)
         driver.get(url)
-        
-        # Wait for page to load (adjust timeout as needed)
         try:
             WebDriverWait(driver, 15).until(
                 EC.presence_of_element_located((By.TAG_NAME, "body"))
             )
+            WebDriverWait(driver, 15).until(
+                lambda d: d.execute_script("return document.readyState") == "complete"
+            )
         except TimeoutException:
             print(f"⚠️ Timeout waiting for page to load: {url}")
-            return set()
-        
-        # Give JavaScript a moment to render content
-        time.sleep(2)
-        
-        # Get page source after JavaScript execution
-        page_source = driver.page_source
+            return None
+        return driver.page_source
+
+
+def download_and_process_page(url, page):
+    """Downloads a page (plain HTTP first, browser as fallback), saves its text
+    content to the temp folder and extracts links from <a> tags.
+    `page` is the page's record from the previous crawl. Returns
+    (links, fetch method, updated page record, article to post or None)."""
+    print(f"🔍 Processing URL: {url}")
+
+    try:
+        page_source = None
+        method = "http"
+        headers = {}
+        try:
+            status, page_source, headers = fetch_with_http(url, page)
+            if status == 304:
+                # Unchanged since last crawl - refresh its timestamp and reuse
+                # the links we saw then
+                article = {"title": page.get("title", "Untitled"), "url": url,
+                           "content": None, "temp_path": None,
+                           "validators": {}, "record": page}
+                return set(page.get("links", [])), "unchanged", page, article
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️ HTTP fetch failed for {url}, falling back to browser: {e}")
+        if page_source is None:
+            method = "browser"
+            page_source = fetch_with_browser(url)
+        if page_source is None:
+            return set(), None, page, None
+
         soup = BeautifulSoup(page_source, "html.parser")
 
         # Extract title from page
         title_tag = soup.find("title")
         title = title_tag.get_text(strip=True) if title_tag else "Untitled"
 
-        # Save the page content initially to temp folder
+        # Extract links from <a> tags - the crawl loop filters new ones
+        links = set()
+        for link_tag in soup.find_all("a", href=True):
+            link = urljoin(url, link_tag["href"])
+            if urlparse(link).netloc == urlparse(BASE_URL).netloc:
+                links.add(link)
+
+        text_content = soup.get_text("\n", strip=True)
+        # Validators are only recorded once the new content is stored
+        validators = {
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "content_hash": content_hash(text_content)
+        }
+        record = dict(page, title=title, links=sorted(links))
+        article = {"title": title, "url": url, "content": None,
+                   "temp_path": None, "validators": validators,
+                   "record": record}
+
+        if (validators["content_hash"] == page.get("content_hash") and
+                article_file_exists(page)):
+            # Content unchanged - nothing new to store or embed
+            return links, "unchanged", record, article
+
+        # Save the page content initially to temp folder. The URL hash keeps
+        # names unique when pages are processed concurrently
         parsed_url = urlparse(url)
         path_segments = [part for part in parsed_url.path.split("/") if part]
         temp_filename = (path_segments[-1].replace("-", "_")
-                         .replace(":", "").replace("/", "_") 
+                         .replace(":", "").replace("/", "_")
                          if path_segments else "home")
-        temp_filepath = os.path.join(temp_dir_path, f"{temp_filename}")
+        url_hash = hashlib.sha1(url.encode("utf-8")).hexdigest()[:8]
+        temp_filepath = os.path.join(temp_dir_path, f"{temp_filename}_{url_hash}")
 
-        text_content = soup.get_text("\n", strip=True)
         with open(temp_filepath, "w", encoding="utf-8") as f:
             f.write(text_content)
         print(f"✅ Saved page content to temp folder: {temp_filepath}")
 
-        # Post to articles service
-        uuid = post_to_articles_service(title, url, text_content)
-
-        if uuid:
-            # Move file from temp to main directory with UUID name
-            uuid_filepath = os.path.join(articles_dir_path, f"{uuid}")
-            os.rename(temp_filepath, uuid_filepath)
-            print(f"📝 Moved file to main directory: {uuid_filepath}")
-        else:
-            # Leave the file in temp folder - it will be cleaned up before
-            # embeddings
-            print(f"⚠️ Failed to post to articles service, file left in "
-                  f"temp: {temp_filepath}")
-
-        # Extract new links from <a> tags
-        new_links = set()
-        for link_tag in soup.find_all("a", href=True):
-            link = urljoin(url, link_tag["href"])
-            parsed_link = urlparse(link)
-            normalized_link = normalize_url(link)
-            if (parsed_link.netloc == urlparse(BASE_URL).netloc and 
-                normalized_link not in visited and 
-                normalized_link not in queue):
-                new_links.add(link)
-                print(f"🔗 Found new link: {link}")
-        
-        return new_links
+        # Posted in the next bulk request - known urls keep their article id
+        article["content"] = text_content
+        article["temp_path"] = temp_filepath
+        return links, method, record, article
 
     except WebDriverException as e:
         print(f"⚠️ WebDriver error processing {url}: {e}")
-        return set()
+        return set(), None, page, None
     except Exception as e:
         print(f"⚠️ Error processing {url}: {e}")
-        return set()
-    finally:
-        # Always clean up the driver
-        if driver:
-            driver.quit()
+        return set(), None, page, None
+
+
+def report_progress(stats, start, remaining):
+    elapsed = time.perf_counter() - start
+    print(f"📊 Processed {stats['pages']} pages in {elapsed:.0f}s "
+          f"({stats['pages'] / elapsed:.2f} pages/sec; {stats['http']} via HTTP, "
+          f"{stats['browser']} via browser, {stats['unchanged']} unchanged, "
+          f"{stats['failed']} failed), "
+          f"{remaining} remaining in queue")
 
 
 def main():
-    print("🚀 Starting to collect and download page content using Selenium...")
-    
-    # Process pages sequentially to avoid overwhelming the server with 
-    # multiple browser instances
-    processed_count = 0
-    while queue:
-        current_url = queue.pop()
-        newly_found_links = download_and_process_page(current_url)
-        queue.update(newly_found_links)
-        processed_count += 1
-        
-        # Be gentle on the server and system resources
-        time.sleep(1)
-        
-        # Log progress
-        if processed_count % 10 == 0:
-            print(f"📊 Processed {processed_count} pages, "
-                  f"{len(queue)} remaining in queue")
+    state = load_crawl_state()
+    pages = state["pages"]
+
+    # Resume an interrupted run from its saved frontier
+    if state["frontier"]:
+        visited.update(state["visited"])
+        queue_urls.clear()
+        queue_urls.update(state["frontier"])
+        print(f"♻️ Resuming crawl: {len(visited)} pages done, "
+              f"{len(queue_urls)} in frontier")
+
+    print(f"🚀 Starting crawl with {CRAWL_WORKERS} workers and "
+          f"{BROWSER_POOL_SIZE} browsers...")
+
+    start = time.perf_counter()
+    stats = {"pages": 0, "http": 0, "browser": 0, "unchanged": 0, "failed": 0}
+    in_flight = {}
+    pending = []
+
+    def checkpoint():
+        ingest_pending(pending)
+        # In-flight pages go back into the frontier so a resumed run redoes them
+        in_flight_urls = set(in_flight.values())
+        state["frontier"] = sorted(queue_urls | in_flight_urls)
+        state["visited"] = sorted(visited - {normalize_url(url)
+                                             for url in in_flight_urls})
+        save_crawl_state(state)
+
+    try:
+        with ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as executor:
+            while queue_urls or in_flight:
+                # Keep every worker busy while there is work in the frontier
+                while queue_urls and len(in_flight) < CRAWL_WORKERS:
+                    url = queue_urls.pop()
+                    normalized_url = normalize_url(url)
+                    if normalized_url in visited:
+                        continue
+                    visited.add(normalized_url)
+                    future = executor.submit(download_and_process_page, url,
+                                             pages.get(normalized_url, {}))
+                    in_flight[future] = url
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = in_flight.pop(future)
+                    links, method, record, article = future.result()
+                    pages[normalize_url(url)] = record
+                    if article:
+                        pending.append(article)
+                        if len(pending) >= INGEST_BATCH_SIZE:
+                            ingest_pending(pending)
+                    stats["pages"] += 1
+                    stats[method or "failed"] += 1
+
+                    for link in links:
+                        normalized_link = normalize_url(link)
+                        if (normalized_link not in visited and
+                                link not in queue_urls):
+                            queue_urls.add(link)
+                            print(f"🔗 Found new link: {link}")
+
+                    # Log progress and persist the frontier
+                    if stats["pages"] % 10 == 0:
+                        report_progress(stats, start, len(queue_urls))
+                    if stats["pages"] % CRAWL_STATE_SAVE_INTERVAL == 0:
+                        checkpoint()
+    except BaseException:
+        checkpoint()
+        raise
+    finally:
+        driver_pool.close()
+
+    # Crawl complete - the next run starts from the beginning
+    ingest_pending(pending)
+    state["frontier"] = []
+    state["visited"] = []
+    save_crawl_state(state)
 
+    report_progress(stats, start, len(queue_urls))
     print("✅ Finished! Attempted to download content from all "
-          "discovered pages using Selenium.")
+          "discovered pages.")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()